@@ -3,6 +3,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+from .engine import get_engine_profile, engine_options_for, register_pragmas
+from . import pdf_cache, instrumentation, metrics
 
 # Load environment variables from .env file (optional but recommended)
 load_dotenv()
@@ -10,8 +12,12 @@ load_dotenv()
 db = SQLAlchemy()
 migrate = Migrate()
 
-def create_app():
-    """Create and configure an instance of the Flask application."""
+def create_app(test_config=None):
+    """Create and configure an instance of the Flask application.
+
+    test_config, if given, is a mapping of config values applied after the
+    defaults (e.g. a separate database URI for tests or scripts).
+    """
     app = Flask(__name__, instance_relative_config=True)
 
     # --- Configuration ---
@@ -28,12 +34,58 @@ def create_app():
     # Database configuration (SQLite in the instance folder)
     app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(app.instance_path, 'database.db')}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Disable modification tracking
+    # Engine profile: 'default' (plain SQLite) or 'production' (WAL, busy timeout,
+    # tuned pragmas and pool) for several gunicorn workers sharing the file.
+    app.config['DB_ENGINE_PROFILE'] = os.environ.get('DB_ENGINE_PROFILE', 'default')
+
+    # Rendered invoice PDFs are cached on disk, shared by all workers
+    app.config['PDF_CACHE_ENABLED'] = os.environ.get('PDF_CACHE_ENABLED', '1') != '0'
+    app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR') # Defaults to <instance>/pdf_cache
+    app.config['PDF_CACHE_MAX_BYTES'] = int(os.environ.get('PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    # 'xhtml2pdf' converts the invoice HTML template; 'reportlab' draws the same layout directly (much faster)
+    app.config['PDF_RENDERER'] = os.environ.get('PDF_RENDERER', 'xhtml2pdf')
+    # 'sync' renders PDFs inside the request; 'async' hands them to a local process
+    # pool and lets the browser poll until the result is in the PDF cache
+    app.config['PDF_RENDER_MODE'] = os.environ.get('PDF_RENDER_MODE', 'sync')
+    app.config['PDF_RENDER_PROCESSES'] = int(os.environ.get('PDF_RENDER_PROCESSES', 2)) # Per gunicorn worker
+    app.config['PDF_JOB_TIMEOUT'] = int(os.environ.get('PDF_JOB_TIMEOUT', 120)) # Seconds before a pending job is resubmitted
+    app.config['PDF_MERGE_MAX_INVOICES'] = int(os.environ.get('PDF_MERGE_MAX_INVOICES', 500)) # Larger bulk exports must use format=zip (0 = no cap)
+
+    # 'offset' (numbered pages) or 'cursor' (keyset pages, constant cost however deep)
+    # for the invoice list and transaction report; ?paging= overrides per request
+    app.config['PAGINATION_MODE'] = os.environ.get('PAGINATION_MODE', 'offset')
+    app.config['PAGINATION_COUNT_LIMIT'] = int(os.environ.get('PAGINATION_COUNT_LIMIT', 1000)) # Cursor mode counts rows up to this (0 = no count)
+
+    # SQL statements a request may run before it is reported ('log') or fails ('raise');
+    # a page whose query count grows with its rows is an N+1 to fix
+    app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 25)) # 0 = no check
+    app.config['SQL_QUERY_BUDGET_MODE'] = os.environ.get('SQL_QUERY_BUDGET_MODE', 'log')
+
+    # Per-endpoint latency, SQL and PDF render metrics at /metrics, summed over all
+    # workers from one small file per worker process, rewritten at most once per interval
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR') # Defaults to <instance>/metrics
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0)) # Seconds between a worker's writes
+
+    if test_config:
+        app.config.update(test_config)
+
+    profile = get_engine_profile(app.config['DB_ENGINE_PROFILE'])
+    engine_options = engine_options_for(profile, app.config['SQLALCHEMY_DATABASE_URI'])
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
 
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)  # Initialize Flask-Migrate
+    pdf_cache.init_app(app)
 
     with app.app_context():
+        # Per-connection pragmas must be in place before the first connection is made
+        register_pragmas(db.engine, profile['pragmas'])
+        instrumentation.init_app(app, db.engine)
+        metrics.init_app(app)
+
         # Import parts of our application
         from . import routes
         from . import models # Import models to ensure they are known to SQLAlchemy
@@ -41,4 +93,7 @@ def create_app():
         # Register Blueprints
         app.register_blueprint(routes.main_bp)
 
+        from . import commands
+        commands.init_app(app)
+
         return app
\ No newline at end of file
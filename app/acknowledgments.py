@@ -0,0 +1,57 @@
+"""Acknowledgment status changes that keep the pending counter in step."""
+from datetime import datetime
+from sqlalchemy import update
+from .models import db, Invoice
+from .counters import adjust_counter, PENDING_ACKNOWLEDGMENTS
+
+
+def set_acknowledgment_status(invoice_ids, status, note, acknowledged_at=None):
+    """
+    Sets the acknowledgment status and note of the given invoices. The
+    acknowledgment date is set (to acknowledged_at or now) for ACKNOWLEDGED and
+    cleared for PENDING.
+
+    Invoices actually changing status are updated by a separate UPDATE whose
+    rowcount moves the pending counter, so the counter stays right even when
+    two requests acknowledge the same invoice at once. Does not commit.
+    Returns the number of invoices whose status changed.
+    """
+    values = {
+        'acknowledgment_status': status,
+        'acknowledgment_note': note,
+        'acknowledgment_date': (acknowledged_at or datetime.utcnow()) if status == 'ACKNOWLEDGED' else None,
+    }
+    # Invoices already in the target status only get the new note/date
+    db.session.execute(
+        update(Invoice).where(
+            Invoice.id.in_(invoice_ids), Invoice.acknowledgment_status == status
+        ).values(**values)
+    )
+    changed = db.session.execute(
+        update(Invoice).where(
+            Invoice.id.in_(invoice_ids), Invoice.acknowledgment_status != status
+        ).values(**values)
+    ).rowcount
+    adjust_counter(PENDING_ACKNOWLEDGMENTS, changed if status == 'PENDING' else -changed)
+    return changed
+
+
+def acknowledge_pending(criteria, note, acknowledged_at=None):
+    """
+    Acknowledges every PENDING invoice matching criteria (a list of SQL
+    conditions on Invoice, e.g. selected ids or an office and date range)
+    with one UPDATE, and moves the pending counter by the number of rows it
+    changed. Invoices already acknowledged are left as they are. Does not
+    commit. Returns the ids of the invoices acknowledged.
+    """
+    acknowledged_ids = db.session.scalars(
+        update(Invoice).where(
+            Invoice.acknowledgment_status == 'PENDING', *criteria
+        ).values(
+            acknowledgment_status='ACKNOWLEDGED',
+            acknowledgment_note=note,
+            acknowledgment_date=acknowledged_at or datetime.utcnow()
+        ).returning(Invoice.id)
+    ).all()
+    adjust_counter(PENDING_ACKNOWLEDGMENTS, -len(acknowledged_ids))
+    return acknowledged_ids
@@ -0,0 +1,256 @@
+"""Bulk CSV import of stock receipts and supplies.
+
+An import is checked as a whole before anything is written: every row is
+parsed and validated, and category and office names are resolved from one
+query per table. The rows are then written in the caller's transaction with
+a handful of statements per import rather than per row: one stock UPDATE per
+category, one invoice number upsert per (office, category, financial year),
+and executemany INSERTs for the invoices, their lines, the transactions and
+the serial numbers. The snapshots, office holdings and pending counter are
+brought up to date in the same transaction. Nothing in this module commits.
+"""
+import csv
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select, insert, func
+from .models import db, StockCategory, Office, StockTransaction, Invoice, InvoiceLine, SerialNumber
+from .utils import get_financial_year, allocate_invoice_numbers
+from .stock_service import increase_stock, decrease_stock, InsufficientStockError
+from .snapshots import rebuild_balance_snapshots
+from .holdings import record_office_receipt
+from .serials import parse_serial_numbers
+from .counters import adjust_counter, PENDING_ACKNOWLEDGMENTS
+
+# Columns each kind of import reads, required ones first
+IMPORT_COLUMNS = {
+    'receipts': ('date', 'category', 'quantity', 'reference_invoice', 'serial_numbers', 'notes'),
+    'supplies': ('date', 'office', 'category', 'quantity', 'serial_numbers'),
+}
+REQUIRED_COLUMNS = {
+    'receipts': ('date', 'category', 'quantity'),
+    'supplies': ('date', 'office', 'category', 'quantity'),
+}
+
+
+class CsvImportError(Exception):
+    """Raised when an import cannot be written; errors is a list of (line number, message)."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} error(s) in import")
+
+
+def _name_lookup(model):
+    # Names are matched ignoring case and surrounding spaces
+    rows = db.session.execute(select(model.id, model.name)).all()
+    return {row.name.strip().casefold(): row.id for row in rows}
+
+
+def read_import(kind, stream):
+    """
+    Parses and validates every row of a CSV import of kind 'receipts' or
+    'supplies'. Returns the rows as dicts ready to write, or raises
+    CsvImportError listing every bad row.
+    """
+    reader = csv.DictReader(stream)
+    header = [name.strip().lower() for name in reader.fieldnames or []]
+    missing = [name for name in REQUIRED_COLUMNS[kind] if name not in header]
+    if missing:
+        raise CsvImportError([(1, f"Missing column(s): {', '.join(missing)}")])
+    reader.fieldnames = header
+
+    categories = _name_lookup(StockCategory)
+    offices = _name_lookup(Office) if kind == 'supplies' else {}
+
+    rows, errors = [], []
+    dates = {}  # an import has few distinct dates; parse each once
+    line = 1
+    for raw in reader:
+        # A quoted value can span lines, so number each row by where it starts
+        start, line = line + 1, reader.line_num
+        values = {name: (raw.get(name) or '').strip() for name in IMPORT_COLUMNS[kind]}
+        row_errors = []
+
+        transaction_date = dates.get(values['date'])
+        if transaction_date is None:
+            try:
+                transaction_date = dates[values['date']] = datetime.strptime(values['date'], '%Y-%m-%d')
+            except ValueError:
+                row_errors.append(f"Invalid date '{values['date']}' (use YYYY-MM-DD)")
+        try:
+            quantity = int(values['quantity'])
+            if quantity <= 0:
+                row_errors.append('Quantity must be a positive number')
+        except ValueError:
+            row_errors.append(f"Invalid quantity '{values['quantity']}'")
+        category_id = categories.get(values['category'].casefold())
+        if category_id is None:
+            row_errors.append(f"Unknown stock category '{values['category']}'")
+        if kind == 'supplies':
+            office_id = offices.get(values['office'].casefold())
+            if office_id is None:
+                row_errors.append(f"Unknown office '{values['office']}'")
+
+        if row_errors:
+            errors.extend((start, message) for message in row_errors)
+            continue
+
+        row = {
+            'line': start,
+            'date': transaction_date,
+            'category_id': category_id,
+            'quantity': quantity,
+            'serial_numbers': values['serial_numbers'] or None,
+        }
+        if kind == 'supplies':
+            row['office_id'] = office_id
+        else:
+            row['reference_invoice'] = values['reference_invoice'] or None
+            row['notes'] = values['notes'] or None
+        rows.append(row)
+
+    if errors:
+        raise CsvImportError(errors)
+    if not rows:
+        raise CsvImportError([(1, 'No rows to import')])
+    return rows
+
+
+def _insert_rows(model, params):
+    """
+    INSERTs params with one executemany and returns the new ids, in params order.
+
+    Ids are assigned here, following the table's current highest id: the
+    stock UPDATE that starts every import already holds SQLite's write lock,
+    so no other writer can take them, and plain executemany (no RETURNING)
+    is the fastest way to load the rows.
+    """
+    first_id = db.session.execute(select(func.coalesce(func.max(model.id), 0))).scalar_one() + 1
+    ids = range(first_id, first_id + len(params))
+    for row_id, row in zip(ids, params):
+        row['id'] = row_id
+    db.session.execute(insert(model.__table__), params)
+    return ids
+
+
+def _insert_serial_numbers(rows, transaction_ids, invoice_ids=None):
+    params = []
+    for index, (row, transaction_id) in enumerate(zip(rows, transaction_ids)):
+        invoice_id = invoice_ids[index] if invoice_ids else None
+        params.extend(
+            {'serial': serial, 'stock_transaction_id': transaction_id, 'invoice_id': invoice_id}
+            for serial in parse_serial_numbers(row['serial_numbers'])
+        )
+    if params:
+        db.session.execute(insert(SerialNumber.__table__), params)
+
+
+def _category_totals(rows):
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row['category_id']] += row['quantity']
+    return totals
+
+
+def import_receipts(rows):
+    """Writes validated receipt rows (from read_import). Returns the number of rows written."""
+    totals = _category_totals(rows)
+    for category_id, quantity in totals.items():
+        increase_stock(category_id, quantity)
+
+    transaction_ids = _insert_rows(StockTransaction, [{
+        'stock_category_id': row['category_id'],
+        'quantity': row['quantity'],
+        'transaction_type': 'IN',
+        'transaction_date': row['date'],
+        'reference_invoice': row['reference_invoice'],
+        'serial_numbers': row['serial_numbers'],
+        'notes': row['notes'],
+    } for row in rows])
+    _insert_serial_numbers(rows, transaction_ids)
+    rebuild_balance_snapshots(totals.keys())
+    return len(rows)
+
+
+def import_supplies(rows):
+    """
+    Writes validated supply rows (from read_import), issuing one invoice per
+    row. Raises CsvImportError if any category lacks the stock for its rows;
+    the caller must then roll back. Returns the number of rows written.
+    """
+    totals = _category_totals(rows)
+    shortages = []
+    for category_id, quantity in totals.items():
+        try:
+            decrease_stock(category_id, quantity)
+        except InsufficientStockError as e:
+            shortages.append(e)
+    if shortages:
+        first_line = {}
+        for row in rows:
+            first_line.setdefault(row['category_id'], row['line'])
+        raise CsvImportError([
+            (first_line[e.category_id], f"Insufficient stock: rows for this category need {e.requested}, available {e.available}")
+            for e in shortages
+        ])
+
+    # Invoice numbers run in date order within each office, category and year
+    groups = defaultdict(list)
+    for row in rows:
+        row['financial_year'] = get_financial_year(row['date'])
+        groups[(row['office_id'], row['category_id'], row['financial_year'])].append(row)
+    for (office_id, category_id, fy), group in groups.items():
+        group.sort(key=lambda row: (row['date'], row['line']))
+        numbers = allocate_invoice_numbers(office_id, category_id, fy, len(group))
+        for row, number in zip(group, numbers):
+            row['invoice_number'] = number
+        record_office_receipt(office_id, category_id, fy,
+                              sum(row['quantity'] for row in group), group[-1]['date'])
+
+    created_at = datetime.utcnow()
+    invoice_ids = _insert_rows(Invoice, [{
+        'invoice_number': row['invoice_number'],
+        'financial_year': row['financial_year'],
+        'date': row['date'],
+        'created_at': created_at,
+        'office_id': row['office_id'],
+        'stock_category_id': row['category_id'],
+        'quantity': row['quantity'],
+        'serial_numbers': row['serial_numbers'],
+        'acknowledgment_status': 'PENDING',
+    } for row in rows])
+    # Each imported invoice has a single line
+    db.session.execute(insert(InvoiceLine.__table__), [{
+        'invoice_id': invoice_id,
+        'stock_category_id': row['category_id'],
+        'quantity': row['quantity'],
+        'serial_numbers': row['serial_numbers'],
+    } for row, invoice_id in zip(rows, invoice_ids)])
+    transaction_ids = _insert_rows(StockTransaction, [{
+        'stock_category_id': row['category_id'],
+        'office_id': row['office_id'],
+        'quantity': -row['quantity'],
+        'transaction_type': 'OUT',
+        'transaction_date': row['date'],
+        'invoice_id': invoice_id,
+        'serial_numbers': row['serial_numbers'],
+    } for row, invoice_id in zip(rows, invoice_ids)])
+    _insert_serial_numbers(rows, transaction_ids, invoice_ids)
+
+    adjust_counter(PENDING_ACKNOWLEDGMENTS, len(rows))
+    rebuild_balance_snapshots(totals.keys())
+    return len(rows)
+
+
+def import_csv(kind, stream, dry_run=False):
+    """
+    Validates and (unless dry_run) writes a CSV import of kind 'receipts' or
+    'supplies'. Returns the number of rows; raises CsvImportError with the
+    line number of every problem. Does not commit.
+    """
+    rows = read_import(kind, stream)
+    if dry_run:
+        return len(rows)
+    if kind == 'supplies':
+        return import_supplies(rows)
+    return import_receipts(rows)
@@ -0,0 +1,75 @@
+"""Maintenance commands, run with `flask <command>`."""
+import click
+from flask.cli import with_appcontext
+from .models import db
+from .counters import recount_pending_acknowledgments
+from .snapshots import rebuild_balance_snapshots
+from .holdings import rebuild_office_stock
+from .search import rebuild_search_index
+from .bulk_import import import_csv, CsvImportError, IMPORT_COLUMNS
+
+
+def init_app(app):
+    app.cli.add_command(repair_counters)
+    app.cli.add_command(rebuild_stock_snapshots)
+    app.cli.add_command(rebuild_office_stock_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(import_stock)
+
+
+@click.command('repair-counters')
+@with_appcontext
+def repair_counters():
+    """Recompute the stored counters from the source tables."""
+    count = recount_pending_acknowledgments()
+    db.session.commit()
+    click.echo(f"pending_acknowledgments = {count}")
+
+
+@click.command('rebuild-stock-snapshots')
+@with_appcontext
+def rebuild_stock_snapshots():
+    """Recompute the daily stock balance snapshots from the transaction history."""
+    count = rebuild_balance_snapshots()
+    db.session.commit()
+    click.echo(f"{count} stock balance snapshots rebuilt")
+
+
+@click.command('rebuild-office-stock')
+@with_appcontext
+def rebuild_office_stock_command():
+    """Recompute the per sub-office holdings from the invoices."""
+    count = rebuild_office_stock()
+    db.session.commit()
+    click.echo(f"{count} office stock rows rebuilt")
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Create the full-text search index if missing and reindex every row."""
+    rebuild_search_index()
+    db.session.commit()
+    click.echo("Search index rebuilt")
+
+
+@click.command('import-stock')
+@click.argument('kind', type=click.Choice(list(IMPORT_COLUMNS)))
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate the file without writing anything.')
+@with_appcontext
+def import_stock(kind, csv_path, dry_run):
+    """Import receipts or supplies from a CSV file, all rows or none."""
+    try:
+        with open(csv_path, encoding='utf-8-sig', newline='') as csv_file:
+            count = import_csv(kind, csv_file, dry_run=dry_run)
+    except CsvImportError as e:
+        db.session.rollback()
+        for line, message in e.errors:
+            click.echo(f"line {line}: {message}", err=True)
+        raise click.ClickException(f"{len(e.errors)} error(s); nothing imported")
+    if dry_run:
+        click.echo(f"{count} {kind} rows are valid (dry run, nothing imported)")
+        return
+    db.session.commit()
+    click.echo(f"{count} {kind} rows imported")
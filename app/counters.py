@@ -0,0 +1,55 @@
+"""Stored aggregates kept in the app_counter table.
+
+Values are adjusted with single upserts inside the transaction that changes
+the rows they count, so they commit or roll back together with them. Reading
+one is a primary key lookup instead of a COUNT over the source table.
+"""
+from flask import g
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import db, AppCounter, Invoice
+
+PENDING_ACKNOWLEDGMENTS = 'pending_acknowledgments'
+
+
+def adjust_counter(name, delta):
+    """Adds delta to the named counter (creating it at delta). Does not commit."""
+    if not delta:
+        return
+    table = AppCounter.__table__
+    stmt = sqlite_insert(table).values(name=name, value=delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={'value': table.c.value + delta}
+    )
+    db.session.execute(stmt)
+
+
+def set_counter(name, value):
+    """Overwrites the named counter. Does not commit."""
+    table = AppCounter.__table__
+    stmt = sqlite_insert(table).values(name=name, value=value)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.name], set_={'value': value})
+    db.session.execute(stmt)
+
+
+def get_counter(name):
+    """Current value of the named counter (0 if it was never set)."""
+    value = db.session.execute(select(AppCounter.value).where(AppCounter.name == name)).scalar_one_or_none()
+    return value or 0
+
+
+def pending_acknowledgment_count():
+    """Number of PENDING invoices, read once per request for the navbar badge."""
+    if 'pending_acknowledgment_count' not in g:
+        g.pending_acknowledgment_count = get_counter(PENDING_ACKNOWLEDGMENTS)
+    return g.pending_acknowledgment_count
+
+
+def recount_pending_acknowledgments():
+    """Recomputes the pending acknowledgment counter from the invoice table. Returns the new value."""
+    count = db.session.execute(
+        select(func.count(Invoice.id)).where(Invoice.acknowledgment_status == 'PENDING')
+    ).scalar_one()
+    set_counter(PENDING_ACKNOWLEDGMENTS, count)
+    return count
@@ -0,0 +1,76 @@
+"""SQLite engine profiles.
+
+create_app() picks a profile by name (DB_ENGINE_PROFILE) and passes its engine
+options to Flask-SQLAlchemy. The profile's pragmas are applied to every new
+DBAPI connection through a SQLAlchemy "connect" event, so each pooled
+connection of each gunicorn worker is set up the same way.
+"""
+from sqlalchemy import event
+
+ENGINE_PROFILES = {
+    # Plain SQLite defaults, as the app has always run in development.
+    'default': {
+        'engine_options': {},
+        'pragmas': {},
+    },
+    # Several gunicorn workers sharing one database file. WAL lets the report
+    # pages keep reading while supply/receive commit, and the busy timeout makes
+    # a second writer wait for the lock instead of failing with
+    # "database is locked".
+    'production': {
+        'engine_options': {
+            # Sync workers serve one request at a time; a couple of spare
+            # connections cover the odd nested session (CLI, background work).
+            'pool_size': 2,
+            'max_overflow': 3,
+            'pool_timeout': 30,
+            'pool_recycle': 3600,
+            'pool_pre_ping': True,
+            # Seconds the sqlite3 driver waits for a lock before giving up.
+            'connect_args': {'timeout': 30},
+        },
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 30000,         # milliseconds
+            'synchronous': 'NORMAL',       # safe with WAL, one fsync per checkpoint
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,      # negative = KiB, i.e. 64 MiB per connection
+            'temp_store': 'MEMORY',
+        },
+    },
+}
+
+
+def get_engine_profile(name):
+    """Returns the named engine profile, raising ValueError for unknown names."""
+    try:
+        return ENGINE_PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown DB_ENGINE_PROFILE {name!r}; expected one of {', '.join(sorted(ENGINE_PROFILES))}"
+        ) from None
+
+
+def engine_options_for(profile, database_uri):
+    """Engine options for the profile, minus pool sizing for in-memory databases."""
+    options = dict(profile['engine_options'])
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        # In-memory SQLite uses a single-connection pool that takes no sizing arguments.
+        for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+            options.pop(key, None)
+    return options
+
+
+def register_pragmas(engine, pragmas):
+    """Applies the given PRAGMA settings to every new connection of the engine."""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
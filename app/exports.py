@@ -0,0 +1,203 @@
+"""Streaming exports.
+
+Each generator here yields the response body in chunks as it is produced, so
+a download starts immediately and memory does not grow with the number of
+rows or documents exported.
+"""
+import csv
+import io
+import re
+import tempfile
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+from pypdf import PdfReader, PdfWriter
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink collecting what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_filename(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', text).strip('_') or 'invoice'
+
+
+def invoice_pdf_filename(invoice):
+    """Unique archive entry name for an invoice (numbers repeat across offices, categories and years)."""
+    return _safe_filename(f"invoice_{invoice.financial_year}_{invoice.id}_{invoice.invoice_number}") + '.pdf'
+
+
+def stream_pdf_zip(invoice_pdfs):
+    """
+    Yields a ZIP archive of (invoice, pdf bytes) pairs, one entry per invoice.
+
+    Invoices whose PDF failed to render are listed in an errors.txt entry at the end.
+    """
+    sink = _ChunkSink()
+    failed = []
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for invoice, data in invoice_pdfs:
+            if data is None:
+                failed.append(invoice)
+                continue
+            # PDFs are already compressed; storing them saves CPU for nothing lost
+            archive.writestr(invoice_pdf_filename(invoice), data)
+            yield sink.drain()
+        if failed:
+            archive.writestr('errors.txt', ''.join(
+                f"Invoice {invoice.invoice_number} ({invoice.financial_year}, id {invoice.id}): PDF could not be generated\n"
+                for invoice in failed
+            ))
+    yield sink.drain()
+
+
+def stream_merged_pdf(invoice_pdfs, chunk_size=64 * 1024, spool_bytes=8 * 1024 * 1024):
+    """
+    Yields a single PDF containing the pages of every (invoice, pdf bytes) pair.
+
+    A PDF's cross-reference table comes last, so the merged document is only
+    written out once every page is in; rendering still happens incrementally
+    and in parallel, but the output is held until the end. It is held in a
+    temporary file past spool_bytes rather than a second in-memory copy; the
+    caller caps how many invoices go into one merge (PDF_MERGE_MAX_INVOICES).
+    """
+    writer = PdfWriter()
+    for invoice, data in invoice_pdfs:
+        if data is not None:
+            writer.append(PdfReader(io.BytesIO(data)))
+    with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as output:
+        writer.write(output)
+        writer.close()
+        output.seek(0)
+        while True:
+            chunk = output.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return '' if value is None else str(value)
+
+
+# A CSV cell starting with one of these is run as a formula by Excel
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_text(value):
+    # User-entered text gets a leading ' so it is shown as typed; numbers are left alone
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return _text(value)
+
+
+def stream_csv(header, rows, batch_size=1000):
+    """Yields a UTF-8 CSV (with a BOM, so Excel detects the encoding) of header plus rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_csv_text(value) for value in row])
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+# Minimal SpreadsheetML package: one worksheet, inline strings, no styles
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+_SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_SHEET_TAIL = '</sheetData></worksheet>'
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append('<c/>')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            text = escape(_XML_ILLEGAL.sub('', _text(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet1', batch_size=1000):
+    """
+    Yields an .xlsx workbook with one sheet of header plus rows.
+
+    The worksheet XML is written into the archive a batch of rows at a time
+    and drained straight to the response, so memory stays flat however many
+    rows there are (no spreadsheet library holding the whole sheet).
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in _XLSX_PARTS.items():
+            archive.writestr(name, xml.replace('{sheet_name}', escape(sheet_name, {'"': '&quot;'})))
+        with archive.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+            batch = [_SHEET_HEAD, _xlsx_row(header)]
+            for row in rows:
+                batch.append(_xlsx_row(row))
+                if len(batch) >= batch_size:
+                    sheet.write(''.join(batch).encode())
+                    batch.clear()
+                    yield sink.drain()
+            batch.append(_SHEET_TAIL)
+            sheet.write(''.join(batch).encode())
+    yield sink.drain()
@@ -0,0 +1,77 @@
+"""Per sub-office holdings, kept in the office_stock table.
+
+Each supply adds its quantity to the (office, category, financial year) row in
+the same transaction as the invoice, so "what has office X received this
+year" is a read of one row per category instead of a scan over
+stock_transaction. Nothing in this module commits.
+"""
+from sqlalchemy import select, delete, func, case, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import db, OfficeStock, StockCategory
+
+# Totals per office, category and financial year from the issued invoice
+# lines; used by rebuild_office_stock()
+REBUILD_OFFICE_STOCK_SQL = (
+    "INSERT INTO office_stock (office_id, stock_category_id, financial_year, quantity_received, last_supply_date) "
+    "SELECT i.office_id, l.stock_category_id, i.financial_year, SUM(l.quantity), MAX(i.date) "
+    "FROM invoice_line l JOIN invoice i ON i.id = l.invoice_id "
+    "GROUP BY i.office_id, l.stock_category_id, i.financial_year"
+)
+
+
+def record_office_receipt(office_id, category_id, financial_year, quantity, supply_date):
+    """Adds a supply of quantity to the office's holdings for the financial year."""
+    table = OfficeStock.__table__
+    stmt = sqlite_insert(table).values(
+        office_id=office_id,
+        stock_category_id=category_id,
+        financial_year=financial_year,
+        quantity_received=quantity,
+        last_supply_date=supply_date
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.office_id, table.c.stock_category_id, table.c.financial_year],
+        set_={
+            'quantity_received': table.c.quantity_received + quantity,
+            'last_supply_date': func.max(func.coalesce(table.c.last_supply_date, stmt.excluded.last_supply_date),
+                                         stmt.excluded.last_supply_date),
+        }
+    )
+    db.session.execute(stmt)
+
+
+def office_holdings(office_id, financial_year):
+    """
+    Returns one row per category the office has ever received: category name,
+    quantity received in financial_year, last supply date in that year, and
+    quantity received in all years.
+    """
+    this_year = OfficeStock.financial_year == financial_year
+    in_year = func.sum(case((this_year, OfficeStock.quantity_received), else_=0))
+    last_in_year = func.max(case((this_year, OfficeStock.last_supply_date)))
+    return db.session.execute(
+        select(
+            StockCategory.name.label('category_name'),
+            in_year.label('received_this_year'),
+            last_in_year.label('last_supply_date'),
+            func.sum(OfficeStock.quantity_received).label('received_all_time')
+        ).join(
+            StockCategory, OfficeStock.stock_category_id == StockCategory.id
+        ).where(
+            OfficeStock.office_id == office_id
+        ).group_by(StockCategory.id).order_by(StockCategory.name)
+    ).all()
+
+
+def holding_financial_years():
+    """Financial years that have any office holdings, most recent first."""
+    return db.session.scalars(
+        select(OfficeStock.financial_year).distinct().order_by(OfficeStock.financial_year.desc())
+    ).all()
+
+
+def rebuild_office_stock():
+    """Recomputes every office holding from the invoice lines. Returns the number of rows."""
+    db.session.execute(delete(OfficeStock))
+    db.session.execute(text(REBUILD_OFFICE_STOCK_SQL))
+    return db.session.execute(select(func.count()).select_from(OfficeStock)).scalar_one()
@@ -0,0 +1,78 @@
+"""Per-request SQL statement counting and timing.
+
+Every statement the engine sends during a request is counted and timed on
+flask.g, where the metrics module also picks the totals up. When a request
+ends with more statements than its budget (SQL_QUERY_BUDGET, or the view's own
+@query_budget), the overrun is logged, or raised as QueryBudgetExceeded when
+SQL_QUERY_BUDGET_MODE = 'raise' (as in tests), so a page whose query count
+grows with its rows is caught instead of shipped.
+"""
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request runs more SQL statements than its budget allows."""
+
+
+def query_budget(limit):
+    """Overrides SQL_QUERY_BUDGET for one view (None disables the check)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapped.query_budget = limit
+        return wrapped
+    return decorator
+
+
+def query_count(request_globals=g):
+    """Number of SQL statements run so far in the current request (or the one request_globals belongs to)."""
+    return request_globals.get('sql_query_count', 0)
+
+
+def query_time(request_globals=g):
+    """Seconds spent running SQL statements so far in the current request (or the one request_globals belongs to)."""
+    return request_globals.get('sql_query_time', 0.0)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+        conn.info['statement_started'] = time.perf_counter()
+
+
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    # A statement that failed leaves its start behind; the next one overwrites it
+    started = conn.info.pop('statement_started', None)
+    if started is not None and has_request_context():
+        g.sql_query_time = g.get('sql_query_time', 0.0) + time.perf_counter() - started
+
+
+def _budget_for_request():
+    view = current_app.view_functions.get(request.endpoint)
+    if view is not None and hasattr(view, 'query_budget'):
+        return view.query_budget
+    return current_app.config['SQL_QUERY_BUDGET']
+
+
+def _check_budget(response):
+    count = query_count()
+    if current_app.debug or current_app.testing:
+        response.headers['X-SQL-Query-Count'] = str(count)
+    budget = _budget_for_request()
+    if budget and count > budget:
+        message = f"{request.method} {request.path} ran {count} SQL statements (budget {budget})"
+        if current_app.config['SQL_QUERY_BUDGET_MODE'] == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def init_app(app, engine):
+    """Counts and times the engine's statements per request and checks them against the budget."""
+    event.listen(engine, 'before_cursor_execute', _count_statement)
+    event.listen(engine, 'after_cursor_execute', _time_statement)
+    app.after_request(_check_budget)
@@ -0,0 +1,246 @@
+"""Request, SQL and PDF render metrics in Prometheus text format.
+
+Each gunicorn worker keeps its counters and histograms in memory and writes
+them to its own file ("<pid>.json") in METRICS_DIR: after a request at most
+once every METRICS_FLUSH_INTERVAL seconds, whenever it answers a scrape, and
+when it exits. /metrics sums the files of all workers, so a scrape that lands
+on any one worker reports the whole server; the requests a worker handled in
+its last interval before going idle show up at its next write. Files of
+workers that have exited are kept, so totals never go backwards when
+gunicorn replaces a worker; a worker that reuses a pid carries on from that
+pid's file.
+
+Recorded per endpoint: request count (by method and status), request latency,
+and the number of SQL statements and seconds spent in them. PDF render time
+is recorded per renderer for PDFs rendered inside a request.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from flask import current_app, g, request
+from .instrumentation import query_count, query_time
+from .pdf_cache import write_atomic
+
+PREFIX = 'stockapp_'
+
+# Latency buckets run up to gunicorn's 120 s worker timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PDF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name: (help, label names)
+COUNTERS = {
+    'http_requests_total': ('HTTP requests handled', ('endpoint', 'method', 'status')),
+    'sql_statements_total': ('SQL statements run while handling requests', ('endpoint',)),
+    'sql_seconds_total': ('Seconds spent running SQL statements while handling requests', ('endpoint',)),
+}
+# name: (help, label names, bucket upper bounds)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('HTTP request latency', ('endpoint',), LATENCY_BUCKETS),
+    'pdf_render_duration_seconds': ('Invoice PDF render time inside a request', ('renderer',), PDF_BUCKETS),
+}
+
+_lock = threading.Lock()
+_state = None
+_state_pid = None
+_state_path = None
+_last_flush = 0.0
+
+
+def _empty_state():
+    return {'counters': {name: {} for name in COUNTERS}, 'histograms': {name: {} for name in HISTOGRAMS}}
+
+
+def _path(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _worker_state():
+    """This process's metrics, started from its file if an earlier process had the same pid."""
+    global _state, _state_pid, _state_path, _last_flush
+    # State inherited through fork belongs to the parent
+    if _state is None or _state_pid != os.getpid():
+        _state_pid = os.getpid()
+        _state_path = _path(current_app.extensions['metrics_dir'], _state_pid)
+        _state = _empty_state()
+        _last_flush = time.monotonic()
+        saved = _load(_state_path)
+        if saved:
+            _merge(_state, saved)
+    return _state
+
+
+def _label_key(values):
+    # Label values joined into one JSON-friendly key
+    return json.dumps([str(value) for value in values])
+
+
+def _inc(state, name, labels, amount=1):
+    series = state['counters'][name]
+    key = _label_key(labels)
+    series[key] = series.get(key, 0) + amount
+
+
+def _observe(state, name, labels, value):
+    buckets = HISTOGRAMS[name][2]
+    series = state['histograms'][name]
+    # Per-bucket (not cumulative) counts, then +Inf, sum and count
+    counts = series.setdefault(_label_key(labels), [0] * (len(buckets) + 1) + [0.0, 0])
+    index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+    counts[index] += 1
+    counts[-2] += value
+    counts[-1] += 1
+
+
+def _merge(total, state):
+    for name, series in state.get('counters', {}).items():
+        if name in total['counters']:
+            for key, value in series.items():
+                total['counters'][name][key] = total['counters'][name].get(key, 0) + value
+    for name, series in state.get('histograms', {}).items():
+        if name in total['histograms']:
+            size = len(HISTOGRAMS[name][2]) + 3
+            for key, counts in series.items():
+                if len(counts) != size:
+                    continue  # Written with other buckets (before an upgrade)
+                merged = total['histograms'][name].setdefault(key, [0] * size)
+                for i, value in enumerate(counts):
+                    merged[i] += value
+
+
+def _flush(state):
+    global _last_flush
+    _last_flush = time.monotonic()
+    try:
+        write_atomic(_state_path, json.dumps(state).encode())
+    except OSError as e:
+        current_app.logger.warning(f"Could not write metrics: {e}")
+
+
+@atexit.register
+def _flush_at_exit():
+    # Whatever the last interval recorded; no app context (or logger) here
+    with _lock:
+        if _state is not None and _state_pid == os.getpid():
+            try:
+                write_atomic(_state_path, json.dumps(_state).encode())
+            except OSError:
+                pass
+
+
+def metrics_enabled():
+    return 'metrics_dir' in current_app.extensions
+
+
+def observe_pdf_render(renderer, seconds):
+    """Records one in-request PDF render; written out with the request's other metrics."""
+    if metrics_enabled():
+        with _lock:
+            _observe(_worker_state(), 'pdf_render_duration_seconds', (renderer,), seconds)
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record(labels, started, request_globals):
+    endpoint = labels[0]
+    with _lock:
+        state = _worker_state()
+        _inc(state, 'http_requests_total', labels)
+        _inc(state, 'sql_statements_total', (endpoint,), query_count(request_globals))
+        _inc(state, 'sql_seconds_total', (endpoint,), query_time(request_globals))
+        _observe(state, 'http_request_duration_seconds', (endpoint,), time.perf_counter() - started)
+        if time.monotonic() - _last_flush >= current_app.config['METRICS_FLUSH_INTERVAL']:
+            _flush(state)
+
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    # The endpoint name, not the path, so ids in URLs do not make new series
+    labels = (request.endpoint or 'unmatched', request.method, response.status_code)
+    if response.is_streamed:
+        # A streamed body (the exports) is produced after this hook, along with
+        # its queries; record the request once the server has sent all of it
+        app, request_globals = current_app._get_current_object(), g._get_current_object()
+
+        def _record_streamed():
+            with app.app_context():
+                _record(labels, started, request_globals)
+        response.call_on_close(_record_streamed)
+    else:
+        _record(labels, started, g)
+    return response
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def collect():
+    """Metrics of every worker, summed."""
+    directory = current_app.extensions['metrics_dir']
+    if _state is not None and _state_pid == os.getpid():
+        with _lock:
+            _flush(_state)
+    total = _empty_state()
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            state = _load(entry.path)
+            if state:  # None while being replaced by its worker
+                _merge(total, state)
+    return total
+
+
+def render_metrics():
+    """The summed metrics in Prometheus text exposition format (version 0.0.4)."""
+    total = collect()
+    lines = []
+    for name, (help_text, label_names) in COUNTERS.items():
+        lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} counter"]
+        for key, value in sorted(total['counters'][name].items()):
+            lines.append(f"{PREFIX}{name}{_format_labels(label_names, json.loads(key))} {_format_number(value)}")
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} histogram"]
+        for key, counts in sorted(total['histograms'][name].items()):
+            values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(label_names, values, [('le', bound)])
+                lines.append(f"{PREFIX}{name}_bucket{labels} {cumulative}")
+            labels = _format_labels(label_names, values)
+            lines.append(f"{PREFIX}{name}_sum{labels} {_format_number(counts[-2])}")
+            lines.append(f"{PREFIX}{name}_count{labels} {counts[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Records request metrics into METRICS_DIR, unless METRICS_ENABLED is false."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    directory = app.config['METRICS_DIR'] or os.path.join(app.instance_path, 'metrics')
+    os.makedirs(directory, exist_ok=True)
+    app.extensions['metrics_dir'] = directory
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
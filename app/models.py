@@ -32,9 +32,17 @@ class StockTransaction(db.Model):
     transaction_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=True)
     reference_invoice = db.Column(db.String(100), nullable=True)  # For received stock invoice reference
-    serial_numbers = db.Column(db.String(500), nullable=True)  # For serial numbers
+    serial_numbers = db.Column(db.Text, nullable=True)  # As entered; one row each in serial_number
     notes = db.Column(db.String(200), nullable=True)  # For any additional notes
 
+    # Indexes matched to the report filters: date range first, then category/office
+    __table_args__ = (
+        db.Index('ix_stock_transaction_date_category_office', 'transaction_date', 'stock_category_id', 'office_id'),
+        db.Index('ix_stock_transaction_category_date', 'stock_category_id', 'transaction_date'),
+        db.Index('ix_stock_transaction_office_date', 'office_id', 'transaction_date'),
+        db.Index('ix_stock_transaction_invoice_id', 'invoice_id'),
+    )
+
     def __repr__(self):
         direction = "to" if self.transaction_type == 'OUT' else "from"
         office_name = self.office.name if self.office else "Parent Office"
@@ -47,15 +55,96 @@ class Invoice(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     office_id = db.Column(db.Integer, db.ForeignKey('office.id'), nullable=False)
+    # First line's category: the invoice is numbered in that category's series
     stock_category_id = db.Column(db.Integer, db.ForeignKey('stock_category.id'), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    serial_numbers = db.Column(db.String(500), nullable=True)  # For storing serial numbers
+    quantity = db.Column(db.Integer, nullable=False)  # Total over all lines
+    serial_numbers = db.Column(db.Text, nullable=True)  # All lines' serials; one row each in serial_number
     acknowledgment_status = db.Column(db.String(20), default='PENDING', nullable=False)  # PENDING, ACKNOWLEDGED
     acknowledgment_date = db.Column(db.DateTime, nullable=True)  # When acknowledgment was received
     acknowledgment_note = db.Column(db.String(200), nullable=True)  # Any notes during acknowledgment
-    transaction = db.relationship('StockTransaction', backref='invoice', uselist=False, lazy=True)
+    # One line, and one OUT transaction, per stock category dispatched
+    lines = db.relationship('InvoiceLine', backref='invoice', lazy=True, order_by='InvoiceLine.id', cascade="all, delete-orphan")
+    transactions = db.relationship('StockTransaction', backref='invoice', lazy=True)
+
+    __table_args__ = (
+        UniqueConstraint('office_id', 'stock_category_id', 'financial_year', 'invoice_number', name='uq_invoice_number_office_category_fy'),
+        # Indexes matched to the invoice listings, acknowledgments and daily supply report
+        db.Index('ix_invoice_date', 'date'),
+        db.Index('ix_invoice_created_at', 'created_at'),
+        db.Index('ix_invoice_acknowledgment_status_date', 'acknowledgment_status', 'date'),
+        db.Index('ix_invoice_office_date', 'office_id', 'date'),
+        db.Index('ix_invoice_category_date', 'stock_category_id', 'date'),
+    )
+
+    def __repr__(self):
+        return f'<Invoice {self.invoice_number} ({self.financial_year}) for {self.office.name}>'
+
+class InvoiceLine(db.Model):
+    """Quantity of one stock category dispatched on an invoice."""
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
+    stock_category_id = db.Column(db.Integer, db.ForeignKey('stock_category.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    serial_numbers = db.Column(db.Text, nullable=True)  # As entered for this line
+    stock_category = db.relationship('StockCategory', lazy=True)
+
+    __table_args__ = (
+        UniqueConstraint('invoice_id', 'stock_category_id', name='uq_invoice_line_invoice_category'),
+        db.Index('ix_invoice_line_category', 'stock_category_id'),
+    )
+
+    def __repr__(self):
+        return f'<InvoiceLine {self.invoice_id}: {self.quantity} x {self.stock_category_id}>'
+
+class InvoiceSequence(db.Model):
+    """Last invoice number issued for an office, stock category and financial year."""
+    office_id = db.Column(db.Integer, db.ForeignKey('office.id'), primary_key=True)
+    stock_category_id = db.Column(db.Integer, db.ForeignKey('stock_category.id'), primary_key=True)
+    financial_year = db.Column(db.String(10), primary_key=True)
+    last_number = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<InvoiceSequence {self.office_id}/{self.stock_category_id} {self.financial_year}: {self.last_number}>'
+
+class AppCounter(db.Model):
+    """Named aggregate maintained alongside the rows it counts (e.g. pending acknowledgments)."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<AppCounter {self.name}={self.value}>'
+
+class StockBalanceSnapshot(db.Model):
+    """Head office closing balance of a stock category at the end of a day on which it moved."""
+    stock_category_id = db.Column(db.Integer, db.ForeignKey('stock_category.id'), primary_key=True)
+    snapshot_date = db.Column(db.Date, primary_key=True)
+    closing_balance = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<StockBalanceSnapshot {self.stock_category_id} {self.snapshot_date}: {self.closing_balance}>'
+
+class OfficeStock(db.Model):
+    """Quantity of a stock category supplied to a sub-office in a financial year."""
+    office_id = db.Column(db.Integer, db.ForeignKey('office.id'), primary_key=True)
+    stock_category_id = db.Column(db.Integer, db.ForeignKey('stock_category.id'), primary_key=True)
+    financial_year = db.Column(db.String(10), primary_key=True)
+    quantity_received = db.Column(db.Integer, default=0, nullable=False)
+    last_supply_date = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<OfficeStock {self.office_id}/{self.stock_category_id} {self.financial_year}: {self.quantity_received}>'
+
+class SerialNumber(db.Model):
+    """One serial number moved by a stock transaction (and, for supplies, its invoice)."""
+    id = db.Column(db.Integer, primary_key=True)
+    serial = db.Column(db.String(100, collation='NOCASE'), nullable=False)
+    stock_transaction_id = db.Column(db.Integer, db.ForeignKey('stock_transaction.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=True)
 
-    __table_args__ = (UniqueConstraint('office_id', 'stock_category_id', 'financial_year', 'invoice_number', name='uq_invoice_number_office_category_fy'),)
+    __table_args__ = (
+        db.Index('ix_serial_number_serial', 'serial'),
+        db.Index('ix_serial_number_stock_transaction_id', 'stock_transaction_id'),
+    )
 
     def __repr__(self):
-        return f'<Invoice {self.invoice_number} ({self.financial_year}) for {self.office.name}>'
\ No newline at end of file
+        return f'<SerialNumber {self.serial} (transaction {self.stock_transaction_id})>'
@@ -0,0 +1,113 @@
+"""Keyset (cursor) pagination.
+
+Instead of OFFSET, each page continues from the last row of the previous one:
+rows are ordered by the sort column plus id, and the cursor carries the
+(sort value, id) pair of the row at the page edge. Fetching a page then costs
+the same however deep it is, and no COUNT(*) over the whole filtered set is
+needed; an approximate total is counted only up to a fixed cap.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_, func, select
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that cannot be decoded."""
+
+
+def encode_cursor(value, row_id):
+    """Opaque URL-safe token for a (sort value, id) pair."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    data = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(token, sort_col):
+    """Returns the (sort value, id) pair from a token made by encode_cursor()."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if value is not None and sort_col.type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError, NotImplementedError) as e:
+        raise InvalidCursor(token) from e
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query, with cursors for the neighbouring pages."""
+
+    def __init__(self, items, next_cursor, prev_cursor, total=None, total_is_capped=False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_capped = total_is_capped
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _after(sort_col, id_col, value, row_id, descending):
+    """Rows strictly after (value, row_id) in the given order."""
+    if descending:
+        return or_(sort_col < value, and_(sort_col == value, id_col < row_id))
+    return or_(sort_col > value, and_(sort_col == value, id_col > row_id))
+
+
+def keyset_paginate(query, sort_col, id_col, descending=True, per_page=20,
+                    cursor=None, direction='next', count_limit=None):
+    """
+    Returns a KeysetPage of the (filtered, unordered) query sorted by sort_col then id_col.
+
+    cursor is a token from a previous page's next_cursor (with direction
+    'next') or prev_cursor (with direction 'prev'); no cursor means the first
+    page. sort_col must not be NULL for any row. If count_limit is given, the
+    filtered rows are also counted up to that many (total_is_capped is set
+    when there are more).
+    """
+    filtered = query
+    going_back = cursor is not None and direction == 'prev'
+    # Walking backwards is the same walk in reverse order, flipped at the end
+    reverse = descending != going_back
+    if cursor is not None:
+        value, row_id = decode_cursor(cursor, sort_col)
+        query = query.filter(_after(sort_col, id_col, value, row_id, reverse))
+
+    order = (sort_col.desc(), id_col.desc()) if reverse else (sort_col.asc(), id_col.asc())
+    rows = query.add_columns(sort_col).order_by(*order).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if going_back:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        # Forwards there is a next page if we over-fetched; backwards we came from one
+        if more or going_back:
+            next_cursor = encode_cursor(last[1], _row_id(last[0], id_col))
+        if (more if going_back else cursor is not None):
+            prev_cursor = encode_cursor(first[1], _row_id(first[0], id_col))
+
+    total = None
+    total_is_capped = False
+    if count_limit:
+        capped = filtered.with_entities(id_col).order_by(None).limit(count_limit + 1).subquery()
+        total = filtered.session.execute(select(func.count()).select_from(capped)).scalar_one()
+        total_is_capped = total > count_limit
+        total = min(total, count_limit)
+
+    return KeysetPage(items, next_cursor, prev_cursor, total, total_is_capped)
+
+
+def _row_id(item, id_col):
+    return getattr(item, id_col.key)
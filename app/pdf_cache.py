@@ -0,0 +1,248 @@
+"""On-disk cache of rendered invoice PDFs.
+
+Entries live in one directory under the instance folder, so every gunicorn
+worker shares them. Each invoice has its own subdirectory holding
+"<fingerprint>.pdf", where the fingerprint covers every invoice field the
+template prints; an edited invoice therefore never matches a stale entry, and
+dropping an invoice's PDFs is one directory removal. The total size is capped
+and the least recently used files (by mtime, which is bumped on every hit)
+are evicted first.
+
+Each worker keeps a running total of the cache size, so storing a PDF does
+not scan the directory. The total is measured by a scan in a background
+thread when the worker first stores a PDF, then grown by what the worker
+stores; once it passes the cap, another background scan evicts down to
+EVICT_TO of the cap, so the next scan is far off. Other workers' writes are
+picked up at that scan, so the cache may briefly run over the cap by what
+they stored in between.
+
+Hit/miss counters are kept per worker process in small files next to the
+entries, written at most once per STATS_INTERVAL seconds, and summed when read,
+so the numbers cover all workers.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from flask import current_app
+
+# An eviction scan brings the cache down to this fraction of max_bytes
+EVICT_TO = 0.9
+STATS_INTERVAL = 1.0  # Seconds between a worker's writes of its hit/miss counters
+
+
+class PdfCache:
+    """Size-bounded LRU cache of PDF bytes in a directory shared by all workers."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats_directory = os.path.join(directory, '.stats')
+        os.makedirs(self.stats_directory, exist_ok=True)
+        self._hits = 0
+        self._misses = 0
+        self._stats_written = 0.0
+        self._lock = threading.Lock()
+        self._size = None  # Size found by this worker's last scan; None until its first
+        self._added = 0  # Bytes this worker has stored since
+        self._scanning = False
+
+    @staticmethod
+    def key(invoice_id, fingerprint):
+        return f"{invoice_id}-{fingerprint}"
+
+    def _invoice_directory(self, invoice_id):
+        return os.path.join(self.directory, str(invoice_id))
+
+    def _path(self, key):
+        invoice_id, fingerprint = key.split('-', 1)
+        return os.path.join(self._invoice_directory(invoice_id), f"{fingerprint}.pdf")
+
+    def get(self, key):
+        """Returns the cached bytes for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except OSError:
+            self._record(hit=False)
+            return None
+        self._record(hit=True)
+        return data
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        """Stores data under key, replacing older entries for the same invoice."""
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        replaced = 0
+        # Older fingerprints of the same invoice: a directory of one or two files
+        for entry in _scandir_quietly(directory):
+            if entry.name.endswith('.pdf') and entry.path != path:
+                replaced += _size(entry)
+                _unlink_quietly(entry.path)
+        for attempt in range(2):
+            os.makedirs(directory, exist_ok=True)
+            try:
+                write_atomic(path, data)
+                break
+            except FileNotFoundError:
+                # Another worker invalidated or evicted the invoice's directory meanwhile
+                if attempt:
+                    raise
+        self._grow(len(data) - replaced)
+
+    def invalidate(self, invoice_id):
+        """Removes every cached PDF of the given invoice."""
+        self.invalidate_many([invoice_id])
+
+    def invalidate_many(self, invoice_ids):
+        """Removes every cached PDF of the given invoices, one directory removal each."""
+        for invoice_id in invoice_ids:
+            shutil.rmtree(self._invoice_directory(invoice_id), ignore_errors=True)
+
+    def stats(self):
+        """Hit/miss counters summed over all workers, plus current size."""
+        self._write_stats()
+        hits = misses = 0
+        for entry in os.scandir(self.stats_directory):
+            try:
+                with open(entry.path) as f:
+                    counts = json.load(f)
+            except (OSError, ValueError):
+                continue  # Being rewritten by its worker right now
+            hits += counts.get('hits', 0)
+            misses += counts.get('misses', 0)
+        entries = list(self._entries())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': len(entries),
+            'bytes': sum(_size(entry) for entry in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def _entries(self):
+        for invoice_directory in _scandir_quietly(self.directory):
+            if invoice_directory.name.isdigit() and invoice_directory.is_dir():
+                for entry in _scandir_quietly(invoice_directory.path):
+                    if entry.name.endswith('.pdf'):
+                        yield entry
+            elif invoice_directory.name.endswith('.pdf') and invoice_directory.is_file():
+                # "<invoice id>-<fingerprint>.pdf" from before the per-invoice layout
+                _unlink_quietly(invoice_directory.path)
+
+    def _grow(self, added):
+        with self._lock:
+            self._added += added
+            if self._scanning or (self._size is not None and self._size + self._added <= self.max_bytes):
+                return
+            self._scanning = True
+        threading.Thread(target=self._scan, daemon=True).start()
+
+    def _scan(self):
+        with self._lock:
+            counted = self._added
+        try:
+            size = self._evict()
+        finally:
+            with self._lock:
+                self._scanning = False
+        with self._lock:
+            # Stores made during the scan may be in its total too; that only brings the next scan forward
+            self._size = size
+            self._added -= counted
+
+    def _evict(self):
+        """
+        Measures the cache and, if it is over the cap, removes the least
+        recently used files. Returns the resulting size.
+        """
+        entries = []
+        total = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Evicted by another worker
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            for _, size, path in sorted(entries):
+                _unlink_quietly(path)
+                try:
+                    os.rmdir(os.path.dirname(path))  # Only succeeds once the invoice has no PDFs left
+                except OSError:
+                    pass
+                total -= size
+                if total <= target:
+                    break
+        return total
+
+    def _record(self, hit):
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+        if time.monotonic() - self._stats_written >= STATS_INTERVAL:
+            self._write_stats()
+
+    def _write_stats(self):
+        self._stats_written = time.monotonic()
+        path = os.path.join(self.stats_directory, f"{os.getpid()}.json")
+        try:
+            write_atomic(path, json.dumps({'hits': self._hits, 'misses': self._misses}).encode())
+        except OSError as e:
+            current_app.logger.warning(f"Could not update PDF cache stats: {e}")
+
+
+def write_atomic(path, data):
+    """Writes data to path via a temporary file so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _unlink_quietly(tmp_path)
+        raise
+
+
+def _size(entry):
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+
+def _scandir_quietly(path):
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []  # Removed by another worker
+
+
+def _unlink_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def init_app(app):
+    """Sets up the cache from PDF_CACHE_* config, unless PDF_CACHE_ENABLED is false."""
+    if not app.config['PDF_CACHE_ENABLED']:
+        return
+    directory = app.config['PDF_CACHE_DIR'] or os.path.join(app.instance_path, 'pdf_cache')
+    app.extensions['pdf_cache'] = PdfCache(directory, app.config['PDF_CACHE_MAX_BYTES'])
+
+
+def get_pdf_cache():
+    """The current app's PdfCache, or None when caching is disabled."""
+    return current_app.extensions.get('pdf_cache')
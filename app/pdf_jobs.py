@@ -0,0 +1,167 @@
+"""Background invoice PDF rendering.
+
+With PDF_RENDER_MODE = 'async', /invoice/<id>/pdf no longer renders the PDF
+inside the gunicorn worker. The worker prepares the (cheap) input - HTML for
+xhtml2pdf, plain fields for ReportLab - hands it to a local process pool and
+answers at once with a job id; the finished PDF lands in the PDF cache, where
+any worker can serve it.
+
+A job id is the invoice's PDF cache key, and job state is kept as marker files
+next to the cache, so a client may poll whichever worker it reaches:
+
+    <cache>/.jobs/<job id>.pending   render submitted (holds the submit time)
+    <cache>/.jobs/<job id>.failed    render failed (holds the error)
+    <cache>/<job id>.pdf             render finished
+"""
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from .pdf_cache import get_pdf_cache, write_atomic
+from .utils import invoice_render_job, invoice_pdf_cache_key, PdfRenderError
+
+JOB_ID_PATTERN = re.compile(r'^\d+-[0-9a-f]+$')
+
+_executor = None
+_executor_pid = None
+
+
+def get_render_pool(processes, replace=False):
+    """The render pool of this worker process, created on first use."""
+    global _executor, _executor_pid
+    # A pool inherited through fork belongs to the parent; start a fresh one.
+    # A pool whose child died (replace=True) refuses new work; replace it too.
+    if replace or _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=processes,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _submit_render(invoice):
+    """Queues the invoice's PDF render on this worker's render pool and returns the future."""
+    render, argument = invoice_render_job(invoice)
+    processes = current_app.config['PDF_RENDER_PROCESSES']
+    try:
+        return get_render_pool(processes).submit(render, argument)
+    except BrokenProcessPool:
+        return get_render_pool(processes, replace=True).submit(render, argument)
+
+
+def _marker_path(cache, job_id, state):
+    return os.path.join(cache.directory, '.jobs', f"{job_id}.{state}")
+
+
+def _read_marker(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _remove_marker(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def job_status(job_id):
+    """
+    Returns (status, detail) for a render job; status is 'done', 'pending',
+    'failed' or 'unknown'. A pending job older than PDF_JOB_TIMEOUT seconds is
+    reported as unknown (its worker most likely died), so it will be resubmitted.
+    """
+    cache = get_pdf_cache()
+    if not cache or not JOB_ID_PATTERN.match(job_id):
+        return 'unknown', None
+    if cache.contains(job_id):
+        return 'done', None
+    failed = _read_marker(_marker_path(cache, job_id, 'failed'))
+    if failed is not None:
+        return 'failed', failed
+    submitted = _read_marker(_marker_path(cache, job_id, 'pending'))
+    if submitted is not None:
+        try:
+            if time.time() - float(submitted) < current_app.config['PDF_JOB_TIMEOUT']:
+                return 'pending', None
+        except ValueError:
+            pass
+    return 'unknown', None
+
+
+def enqueue_invoice_pdf(invoice):
+    """Submits the invoice's PDF for background rendering unless it is done or in flight. Returns the job id."""
+    cache = get_pdf_cache()
+    job_id = invoice_pdf_cache_key(invoice)
+    status, _ = job_status(job_id)
+    if status in ('done', 'pending'):
+        return job_id
+
+    pending_path = _marker_path(cache, job_id, 'pending')
+    failed_path = _marker_path(cache, job_id, 'failed')
+    os.makedirs(os.path.dirname(pending_path), exist_ok=True)
+    _remove_marker(failed_path)
+    write_atomic(pending_path, str(time.time()).encode())
+
+    logger = current_app.logger
+
+    def _finished(future):
+        # Runs in this worker's pool management thread, outside any app context
+        try:
+            cache.put(job_id, future.result())
+        except Exception as e:
+            logger.error(f"Error generating PDF for job {job_id}: {e}")
+            write_atomic(failed_path, str(e).encode())
+        finally:
+            _remove_marker(pending_path)
+
+    _submit_render(invoice).add_done_callback(_finished)
+    return job_id
+
+
+def async_rendering_enabled():
+    """Whether PDFs are rendered in the background (needs the PDF cache to hold results)."""
+    return current_app.config['PDF_RENDER_MODE'] == 'async' and get_pdf_cache() is not None
+
+
+def iter_invoice_pdfs(invoices):
+    """
+    Yields (invoice, pdf bytes or None on failure) for each invoice, in order.
+
+    PDFs already in the cache are reused; the rest are rendered on the process
+    pool, keeping at most two jobs per pool process in flight so memory stays
+    bounded however many invoices are exported. Bulk results are not written
+    back to the cache, so a month-end export does not evict everyone's
+    recently viewed invoices.
+    """
+    cache = get_pdf_cache()
+    window = current_app.config['PDF_RENDER_PROCESSES'] * 2
+    in_flight = deque()
+
+    def _resolve(item):
+        invoice, future, data = item
+        if future is not None:
+            try:
+                data = future.result()
+            except (PdfRenderError, BrokenProcessPool) as e:
+                current_app.logger.error(f"Error generating PDF for invoice {invoice.id}: {e}")
+                data = None
+        return invoice, data
+
+    for invoice in invoices:
+        data = cache.get(invoice_pdf_cache_key(invoice)) if cache else None
+        if data is not None:
+            in_flight.append((invoice, None, data))
+        else:
+            in_flight.append((invoice, _submit_render(invoice), None))
+        while len(in_flight) > window:
+            yield _resolve(in_flight.popleft())
+
+    while in_flight:
+        yield _resolve(in_flight.popleft())
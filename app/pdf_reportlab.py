@@ -0,0 +1,103 @@
+"""Invoice PDFs drawn directly with ReportLab.
+
+The same A4 layout as INVOICE_TEMPLATE_HTML (header, sub-office, one row per
+invoice line with a total, serial numbers, signature block, footer), built from ReportLab
+flowables instead of going through xhtml2pdf's HTML/CSS parser. Selected with
+PDF_RENDERER = 'reportlab'.
+
+Works on the plain dict from utils.invoice_print_fields() rather than an ORM
+object, so it can run in a render worker process without an app context.
+"""
+from io import BytesIO
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus.flowables import HRFlowable
+
+MARGIN = 1 * cm
+
+BODY = ParagraphStyle('body', fontName='Helvetica', fontSize=10, leading=13)
+BODY_CENTER = ParagraphStyle('body_center', parent=BODY, alignment=TA_CENTER, spaceAfter=3)
+TITLE = ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=18, leading=22, alignment=TA_CENTER, spaceAfter=6)
+CELL = ParagraphStyle('cell', parent=BODY)
+CELL_HEADER = ParagraphStyle('cell_header', parent=BODY, fontName='Helvetica-Bold')
+SERIALS = ParagraphStyle('serials', parent=BODY, fontSize=9, leading=12)
+SIGNATURE = ParagraphStyle('signature', parent=BODY, spaceAfter=30)
+
+
+def _footer(created_at):
+    def draw(canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 8)
+        canvas.setFillColor(colors.HexColor('#555555'))
+        centre = A4[0] / 2
+        canvas.drawCentredString(centre, MARGIN + 12, "Generated by Stock Management System")
+        canvas.drawCentredString(centre, MARGIN + 2, created_at.strftime('%Y-%m-%d %H:%M:%S'))
+        canvas.restoreState()
+    return draw
+
+
+def render_invoice_pdf(fields):
+    """Returns the invoice PDF as bytes, given the dict from utils.invoice_print_fields()."""
+    width = A4[0] - 2 * MARGIN
+    story = [
+        Paragraph("INVOICE", TITLE),
+        Paragraph(f"Invoice No: {escape(fields['invoice_number'])}", BODY_CENTER),
+        Paragraph(f"Date: {fields['date'].strftime('%d-%b-%Y')}", BODY_CENTER),
+        Paragraph(f"Financial Year: {escape(fields['financial_year'])}", BODY_CENTER),
+        HRFlowable(width='100%', thickness=1, color=colors.black, spaceBefore=4, spaceAfter=20),
+        Paragraph(f"<b>To (Sub-Office):</b> {escape(fields['office_name'])}", BODY),
+        Spacer(1, 20),
+    ]
+
+    multi_line = len(fields['lines']) > 1
+    rows = [[Paragraph("Stock Category", CELL_HEADER), Paragraph("Quantity Dispatched", CELL_HEADER)]]
+    rows += [[Paragraph(escape(line['category_name']), CELL), Paragraph(str(line['quantity']), CELL)]
+             for line in fields['lines']]
+    if multi_line:
+        rows.append([Paragraph("Total", CELL_HEADER), Paragraph(str(fields['quantity']), CELL_HEADER)])
+    lines = Table(rows, colWidths=[width / 2, width / 2])
+    lines.setStyle(TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.75, colors.HexColor('#333333')),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#eeeeee')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    story += [lines, Spacer(1, 20)]
+
+    if fields['serial_numbers']:
+        if multi_line:
+            # Serials grouped under the category they were dispatched with
+            text = '<br/>'.join(f"{escape(line['category_name'])}: {escape(line['serial_numbers'])}"
+                                for line in fields['lines'] if line['serial_numbers'])
+        else:
+            text = escape(fields['serial_numbers'])
+        serials = Table([[Paragraph(f"<b>Serial Numbers:</b><br/>{text}", SERIALS)]],
+                        colWidths=[width])
+        serials.setStyle(TableStyle([
+            ('BOX', (0, 0), (-1, -1), 0.75, colors.HexColor('#999999'), None, (3, 2)),
+            ('TOPPADDING', (0, 0), (-1, -1), 5),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+        ]))
+        story += [Spacer(1, 10), serials]
+
+    story += [
+        Spacer(1, 60),
+        Paragraph("<b>Received By:</b> _______________________", SIGNATURE),
+        Paragraph("<b>Designation:</b> _______________________", SIGNATURE),
+        Paragraph("<b>Date:</b> _______________________", SIGNATURE),
+    ]
+
+    result = BytesIO()
+    doc = SimpleDocTemplate(result, pagesize=A4, leftMargin=MARGIN, rightMargin=MARGIN,
+                            topMargin=MARGIN, bottomMargin=MARGIN + 24,
+                            title=f"Invoice {fields['invoice_number']}")
+    footer = _footer(fields['created_at'])
+    doc.build(story, onFirstPage=footer, onLaterPages=footer)
+    return result.getvalue()
@@ -0,0 +1,51 @@
+"""Per-worker cache of the office and stock category lists.
+
+Offices and categories change rarely but fill a dropdown on almost every
+page. Each worker keeps (id, name) lists in memory, tagged with the
+'refdata_version' counter; every change to an office or category bumps the
+counter in the same transaction. A request reads the counter once (a primary
+key lookup) and reloads the lists only if another worker - or this one - has
+changed them since, so all workers see a change on their next request.
+
+Stock levels are not cached; pages showing current_stock still query them.
+"""
+from collections import namedtuple
+from flask import current_app, g
+from .models import db, StockCategory, Office
+from .counters import adjust_counter, get_counter
+
+REFDATA_VERSION = 'refdata_version'
+
+RefItem = namedtuple('RefItem', 'id name')
+
+
+def bump_refdata_version():
+    """Marks the cached lists stale in every worker once the current transaction commits."""
+    adjust_counter(REFDATA_VERSION, 1)
+
+
+def _load(model):
+    rows = db.session.execute(db.select(model.id, model.name).order_by(model.name)).all()
+    return [RefItem(row.id, row.name) for row in rows]
+
+
+def _refdata():
+    if 'refdata' not in g:
+        version = get_counter(REFDATA_VERSION)
+        cached = current_app.extensions.get('refdata')
+        if cached is None or cached['version'] != version:
+            # Lists read after the version, so at worst they are newer than their tag
+            cached = {'version': version, 'categories': _load(StockCategory), 'offices': _load(Office)}
+            current_app.extensions['refdata'] = cached
+        g.refdata = cached
+    return g.refdata
+
+
+def cached_categories():
+    """All stock categories as (id, name), ordered by name."""
+    return _refdata()['categories']
+
+
+def cached_offices():
+    """All offices as (id, name), ordered by name."""
+    return _refdata()['offices']
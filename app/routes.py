@@ -1,11 +1,30 @@
 from flask import (
-    Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
+    Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, jsonify,
+    Response, stream_with_context
 )
-from .models import db, StockCategory, Office, StockTransaction, Invoice
-from .utils import get_financial_year, generate_next_invoice_number, generate_invoice_pdf
-from datetime import datetime, timedelta
+from .models import db, StockCategory, Office, StockTransaction, Invoice, InvoiceLine
+from .utils import get_financial_year, generate_invoice_pdf, invalidate_invoice_pdf, invalidate_invoice_pdfs, invoice_pdf_cache_key, pdf_response
+from .pdf_jobs import async_rendering_enabled, enqueue_invoice_pdf, job_status, iter_invoice_pdfs
+from .exports import stream_pdf_zip, stream_merged_pdf, stream_csv, stream_xlsx
+from .counters import pending_acknowledgment_count
+from .acknowledgments import set_acknowledgment_status, acknowledge_pending
+from .pdf_cache import get_pdf_cache
+from .metrics import metrics_enabled, render_metrics
+from .stock_service import record_receipt, record_dispatch, record_distribution, InsufficientStockError
+from .pagination import keyset_paginate, InvalidCursor
+from .snapshots import stock_balances_as_of
+from .holdings import office_holdings, holding_financial_years
+from .serials import serial_history
+from .search import search, SearchUnavailable
+from .bulk_import import import_csv, CsvImportError, IMPORT_COLUMNS, REQUIRED_COLUMNS
+from .instrumentation import query_budget
+from .refdata import cached_categories, cached_offices, bump_refdata_version
+from datetime import datetime, date, timedelta
+import io
+from itertools import zip_longest
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload, selectinload
 
 main_bp = Blueprint('main', __name__)
 
@@ -14,7 +33,8 @@ def utility_processor():
     """Add utility functions and models to template context."""
     return {
         'now': datetime.utcnow,
-        'Invoice': Invoice  # Make Invoice model available in templates
+        # Stored count, so the navbar badge is a key lookup rather than a COUNT
+        'pending_acknowledgment_count': pending_acknowledgment_count
     }
 
 @main_bp.route('/')
@@ -24,6 +44,18 @@ def index():
 
 # --- Stock Category Management ---
 
+def _categories_in_use(category_ids):
+    """Ids among category_ids that have any transaction or invoice line, found with one EXISTS query."""
+    return set(db.session.scalars(
+        db.select(StockCategory.id).where(
+            StockCategory.id.in_(category_ids),
+            db.or_(
+                db.select(StockTransaction.id).where(StockTransaction.stock_category_id == StockCategory.id).exists(),
+                db.select(InvoiceLine.id).where(InvoiceLine.stock_category_id == StockCategory.id).exists()
+            )
+        )
+    ))
+
 @main_bp.route('/stock/manage', methods=['GET', 'POST'])
 def manage_stock():
     """Add/Delete Stock Categories."""
@@ -37,6 +69,7 @@ def manage_stock():
                     try:
                         new_category = StockCategory(name=name, current_stock=0)
                         db.session.add(new_category)
+                        bump_refdata_version()
                         db.session.commit()
                         flash(f'Stock category "{name}" added successfully.', 'success')
                     except IntegrityError:
@@ -55,11 +88,12 @@ def manage_stock():
             category = db.session.get(StockCategory, category_id) # Use db.session.get for primary key lookup
             if category:
                  # Basic check: prevent deletion if stock exists or transactions/invoices exist
-                if category.current_stock != 0 or category.transactions or category.invoices:
+                if category.current_stock != 0 or category.id in _categories_in_use([category.id]):
                      flash(f'Cannot delete category "{category.name}" as it has non-zero stock, associated transactions, or invoices.', 'danger')
                 else:
                     try:
                         db.session.delete(category)
+                        bump_refdata_version()
                         db.session.commit()
                         flash(f'Stock category "{category.name}" deleted.', 'success')
                     except Exception as e:
@@ -72,7 +106,8 @@ def manage_stock():
         return redirect(url_for('main.manage_stock'))
 
     categories = StockCategory.query.order_by(StockCategory.name).all()
-    return render_template('manage_stock.html', categories=categories)
+    return render_template('manage_stock.html', categories=categories,
+                           in_use=_categories_in_use([c.id for c in categories]))
 
 @main_bp.route('/stock/categories/modify/<int:category_id>', methods=['POST'])
 def modify_category(category_id):
@@ -95,6 +130,7 @@ def modify_category(category_id):
 
     try:
         category.name = new_name
+        bump_refdata_version()
         db.session.commit()
         flash(f'Category name updated successfully to "{new_name}".', 'success')
     except IntegrityError:
@@ -109,6 +145,18 @@ def modify_category(category_id):
 
 # --- Office Management ---
 
+def _offices_in_use(office_ids):
+    """Ids among office_ids that have any transaction or invoice, found with one EXISTS query."""
+    return set(db.session.scalars(
+        db.select(Office.id).where(
+            Office.id.in_(office_ids),
+            db.or_(
+                db.select(StockTransaction.id).where(StockTransaction.office_id == Office.id).exists(),
+                db.select(Invoice.id).where(Invoice.office_id == Office.id).exists()
+            )
+        )
+    ))
+
 @main_bp.route('/offices/manage', methods=['GET', 'POST'])
 def manage_offices():
     """Add/Delete Sub-Offices."""
@@ -122,6 +170,7 @@ def manage_offices():
                     try:
                         new_office = Office(name=name)
                         db.session.add(new_office)
+                        bump_refdata_version()
                         db.session.commit()
                         flash(f'Office "{name}" added successfully.', 'success')
                     except IntegrityError:
@@ -140,11 +189,12 @@ def manage_offices():
             office = db.session.get(Office, office_id) # Use db.session.get
             if office:
                  # Basic check: prevent deletion if transactions or invoices exist
-                if office.transactions or office.invoices:
+                if office.id in _offices_in_use([office.id]):
                      flash(f'Cannot delete office "{office.name}" as it has associated transactions or invoices.', 'danger')
                 else:
                     try:
                         db.session.delete(office)
+                        bump_refdata_version()
                         db.session.commit()
                         flash(f'Office "{office.name}" deleted.', 'success')
                     except Exception as e:
@@ -156,7 +206,8 @@ def manage_offices():
         return redirect(url_for('main.manage_offices'))
 
     offices = Office.query.order_by(Office.name).all()
-    return render_template('manage_offices.html', offices=offices)
+    return render_template('manage_offices.html', offices=offices,
+                           in_use=_offices_in_use([o.id for o in offices]))
 
 @main_bp.route('/offices/modify/<int:office_id>', methods=['POST'])
 def modify_office(office_id):
@@ -179,6 +230,7 @@ def modify_office(office_id):
 
     try:
         office.name = new_name
+        bump_refdata_version()
         db.session.commit()
         flash(f'Office name updated successfully to "{new_name}".', 'success')
     except IntegrityError:
@@ -217,7 +269,7 @@ def receive_stock():
             flash('Invalid quantity entered.', 'danger')
 
         if not category or quantity is None:
-            categories = StockCategory.query.order_by(StockCategory.name).all()
+            categories = cached_categories()
             return render_template('receive_stock.html', 
                                 categories=categories, 
                                 selected_category=category_id, 
@@ -233,7 +285,7 @@ def receive_stock():
             transaction_datetime = datetime.combine(transaction_date, datetime.min.time())
         except ValueError:
             flash('Invalid date format. Please use YYYY-MM-DD.', 'danger')
-            categories = StockCategory.query.order_by(StockCategory.name).all()
+            categories = cached_categories()
             return render_template('receive_stock.html', 
                                 categories=categories, 
                                 selected_category=category_id,
@@ -244,20 +296,15 @@ def receive_stock():
                                 notes=notes)
 
         try:
-            # Update stock level
-            category.current_stock += quantity
-
-            # Record transaction with new fields
-            transaction = StockTransaction(
-                stock_category_id=category.id,
-                quantity=quantity,
-                transaction_type='IN',
-                transaction_date=transaction_datetime,
+            # Update stock level and record the transaction
+            record_receipt(
+                category.id,
+                quantity,
+                transaction_datetime,
                 reference_invoice=reference_invoice,
                 serial_numbers=serial_numbers,
                 notes=notes
             )
-            db.session.add(transaction)
             db.session.commit()
             flash(f'Successfully received {quantity} of {category.name}. Current stock: {category.current_stock}', 'success')
             return redirect(url_for('main.stock_report'))
@@ -266,7 +313,7 @@ def receive_stock():
             db.session.rollback()
             flash(f'Error receiving stock: {e}', 'danger')
             current_app.logger.error(f"Error receiving stock: {e}")
-            categories = StockCategory.query.order_by(StockCategory.name).all()
+            categories = cached_categories()
             return render_template('receive_stock.html', 
                                 categories=categories,
                                 selected_category=category_id,
@@ -277,136 +324,229 @@ def receive_stock():
                                 notes=notes)
 
     # GET Request
-    categories = StockCategory.query.order_by(StockCategory.name).all()
+    categories = cached_categories()
     return render_template('receive_stock.html', categories=categories)
 
 
 @main_bp.route('/stock/supply', methods=['GET', 'POST'])
 def supply_stock():
-    """Supply stock to a sub-office (decreases head office stock) and generate invoice."""
-    if request.method == 'POST':
-        category_id = request.form.get('category_id')
-        office_id = request.form.get('office_id')
-        quantity_str = request.form.get('quantity')
-        transaction_date_str = request.form.get('transaction_date')
-        serial_numbers = request.form.get('serial_numbers')
-
-        category = db.session.get(StockCategory, category_id)
-        office = db.session.get(Office, office_id)
-        quantity = None
-
-        # Validate quantity
+    """Supply one or more stock categories to a sub-office (decreases head office stock) on one invoice."""
+    offices = cached_offices()
+    if request.method == 'GET':
+        # Categories are read live: the form shows each one's available stock
+        categories = StockCategory.query.order_by(StockCategory.name).all()
+        return render_template('supply_stock.html', categories=categories, offices=offices, lines=[{}])
+
+    office_id = request.form.get('office_id')
+    transaction_date_str = request.form.get('transaction_date')
+    # One form row per invoice line; rows left blank are ignored
+    lines = [
+        {'category_id': category_id, 'quantity': quantity, 'serial_numbers': serial_numbers}
+        for category_id, quantity, serial_numbers in zip_longest(
+            request.form.getlist('category_id'), request.form.getlist('quantity'),
+            request.form.getlist('serial_numbers'), fillvalue=''
+        ) if category_id or quantity.strip()
+    ]
+
+    def form_error(message):
+        flash(message, 'danger')
+        return render_template('supply_stock.html',
+                            categories=StockCategory.query.order_by(StockCategory.name).all(),
+                            offices=offices,
+                            selected_office=office_id,
+                            entered_date=transaction_date_str,
+                            lines=lines or [{}])
+
+    office = db.session.get(Office, office_id) if office_id else None
+    if not office:
+        return form_error('Please select a valid sub-office.')
+    if not lines:
+        return form_error('Add at least one stock category and quantity.')
+
+    category_names = {str(category_id): name for category_id, name in cached_categories()}
+    dispatch = []
+    for line in lines:
+        name = category_names.get(line['category_id'])
         try:
-            quantity = int(quantity_str)
-            if quantity <= 0:
-                flash('Quantity must be a positive number.', 'danger')
-                quantity = None
+            quantity = int(line['quantity'])
         except (ValueError, TypeError):
-            flash('Invalid quantity entered.', 'danger')
+            return form_error('Invalid quantity entered.')
+        if not name:
+            return form_error('Missing or invalid stock category.')
+        if quantity <= 0:
+            return form_error('Quantity must be a positive number.')
+        if any(line['category_id'] == str(category_id) for category_id, _, _ in dispatch):
+            return form_error(f'{name} appears on more than one line.')
+        dispatch.append((int(line['category_id']), quantity, (line['serial_numbers'] or '').strip() or None))
+
+    # Validate and parse date
+    try:
+        transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%d') if transaction_date_str else datetime.utcnow().date()
+        transaction_datetime = datetime.combine(transaction_date, datetime.min.time())
+    except ValueError:
+        return form_error('Invalid date format. Please use YYYY-MM-DD.')
 
-        # Validate category, office, and quantity presence
-        if not category or not office or quantity is None:
-            flash('Missing or invalid category, office, or quantity.', 'danger')
-            categories = StockCategory.query.order_by(StockCategory.name).all()
-            offices = Office.query.order_by(Office.name).all()
-            return render_template('supply_stock.html', 
-                                categories=categories, 
-                                offices=offices,
-                                selected_category=category_id, 
-                                selected_office=office_id,
-                                entered_quantity=quantity_str, 
-                                entered_date=transaction_date_str,
-                                serial_numbers=serial_numbers)
-
-        # Validate stock level
-        if category.current_stock < quantity:
-            flash(f'Insufficient stock for {category.name}. Available: {category.current_stock}', 'danger')
-            categories = StockCategory.query.order_by(StockCategory.name).all()
-            offices = Office.query.order_by(Office.name).all()
-            return render_template('supply_stock.html', 
-                                categories=categories, 
-                                offices=offices,
-                                selected_category=category_id, 
-                                selected_office=office_id,
-                                entered_quantity=quantity_str, 
-                                entered_date=transaction_date_str,
-                                serial_numbers=serial_numbers)
+    try:
+        # Decrease each category's stock (guarded, so it cannot go negative),
+        # create the invoice with its lines and record the OUT transactions
+        new_invoice = record_dispatch(office.id, dispatch, transaction_datetime)
+        inv_num, fy = new_invoice.invoice_number, new_invoice.financial_year
+        db.session.commit()
 
-        # Validate and parse date
+        supplied = ', '.join(f'{quantity} of {category_names[str(category_id)]}' for category_id, quantity, _ in dispatch)
+        flash(f'Successfully supplied {supplied} to {office.name}. Invoice {inv_num} ({fy}) generated.', 'success')
+        return redirect(url_for('main.list_invoices'))
+
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return form_error(f'Insufficient stock for {category_names[str(e.category_id)]}. Available: {e.available}')
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error supplying stock: {e}")
+        return form_error(f'Error supplying stock: {e}')
+
+def _distribution_plan():
+    """
+    Reads a distribution plan from a JSON body ({"category_id", "transaction_date",
+    "lines": [{"office_id", "quantity", "serial_numbers"}]}) or from the form,
+    which has quantity_<office id> and serial_numbers_<office id> fields.
+    Returns (category_id, transaction_date string, [(office_id, quantity string, serials)]).
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        lines = [(line.get('office_id'), line.get('quantity'), line.get('serial_numbers'))
+                 for line in data.get('lines') or [] if isinstance(line, dict)]
+        return data.get('category_id'), data.get('transaction_date'), lines
+    lines = []
+    for office in cached_offices():
+        quantity = request.form.get(f'quantity_{office.id}', '').strip()
+        if quantity:
+            lines.append((office.id, quantity, request.form.get(f'serial_numbers_{office.id}')))
+    return request.form.get('category_id'), request.form.get('transaction_date'), lines
+
+def _validate_distribution_plan(category_id, transaction_date_str, raw_lines):
+    """Returns (category, transaction datetime, lines, errors) for a plan from _distribution_plan()."""
+    errors = []
+    category = db.session.get(StockCategory, category_id) if category_id else None
+    if category is None:
+        errors.append('Select a valid stock category.')
+    try:
+        transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%d') if transaction_date_str else datetime.utcnow()
+        transaction_datetime = datetime.combine(transaction_date, datetime.min.time())
+    except (ValueError, TypeError):
+        transaction_datetime = None
+        errors.append('Invalid date format. Please use YYYY-MM-DD.')
+
+    office_ids = {office.id for office in cached_offices()}
+    lines, seen = [], set()
+    for office_id, quantity_str, serial_numbers in raw_lines:
         try:
-            transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%d') if transaction_date_str else datetime.utcnow().date()
-            transaction_datetime = datetime.combine(transaction_date, datetime.min.time())
-        except ValueError:
-            flash('Invalid date format. Please use YYYY-MM-DD.', 'danger')
-            categories = StockCategory.query.order_by(StockCategory.name).all()
-            offices = Office.query.order_by(Office.name).all()
-            return render_template('supply_stock.html', 
-                                categories=categories, 
-                                offices=offices,
-                                selected_category=category_id, 
-                                selected_office=office_id,
-                                entered_quantity=quantity_str, 
-                                entered_date=transaction_date_str,
-                                serial_numbers=serial_numbers)
+            office_id, quantity = int(office_id), int(quantity_str)
+        except (ValueError, TypeError):
+            errors.append(f'Invalid office or quantity: {office_id}, {quantity_str}.')
+            continue
+        if office_id not in office_ids:
+            errors.append(f'Unknown office {office_id}.')
+        elif office_id in seen:
+            errors.append(f'Office {office_id} appears more than once.')
+        elif quantity <= 0:
+            errors.append('Quantities must be positive numbers.')
+        else:
+            seen.add(office_id)
+            lines.append((office_id, quantity, (serial_numbers or '').strip() or None))
+    if not raw_lines:
+        errors.append('Enter a quantity for at least one office.')
+    return category, transaction_datetime, lines, errors
+
+@main_bp.route('/stock/distribute', methods=['GET', 'POST'])
+@query_budget(None)  # two statements per office line, by design
+def distribute_stock():
+    """
+    Supply one category to many sub-offices in one go: availability is checked
+    and stock decreased once for the total, and every invoice is created in a
+    single transaction. JSON requests get the invoice numbers back as JSON.
+    """
+    categories = StockCategory.query.order_by(StockCategory.name).all()
+    offices = cached_offices()
+    if request.method == 'GET':
+        return render_template('distribute_stock.html', categories=categories, offices=offices, form={})
 
-        # Determine financial year and generate invoice number
-        fy = get_financial_year(transaction_datetime)
-        inv_num = generate_next_invoice_number(office.id, category.id, fy)
+    category_id, transaction_date_str, raw_lines = _distribution_plan()
+    category, transaction_datetime, lines, errors = _validate_distribution_plan(category_id, transaction_date_str, raw_lines)
 
+    if not errors:
         try:
-            # 1. Decrease stock
-            category.current_stock -= quantity
-
-            # 2. Create Invoice with serial numbers and initial acknowledgment status
-            new_invoice = Invoice(
-                invoice_number=inv_num,
-                financial_year=fy,
-                date=transaction_datetime,
-                created_at=datetime.utcnow(),
-                office_id=office.id,
-                stock_category_id=category.id,
-                quantity=quantity,
-                serial_numbers=serial_numbers,
-                acknowledgment_status='PENDING'
-            )
-            db.session.add(new_invoice)
-            db.session.flush()
-
-            # 3. Record Stock Transaction with serial numbers
-            transaction = StockTransaction(
-                stock_category_id=category.id,
-                office_id=office.id,
-                quantity=-quantity,
-                transaction_type='OUT',
-                transaction_date=transaction_datetime,
-                invoice_id=new_invoice.id,
-                serial_numbers=serial_numbers
-            )
-            db.session.add(transaction)
+            invoices = record_distribution(category.id, lines, transaction_datetime)
+            results = [{'invoice_id': invoice.id, 'office_id': invoice.office_id,
+                        'invoice_number': invoice.invoice_number, 'financial_year': invoice.financial_year,
+                        'quantity': invoice.quantity} for invoice in invoices]
             db.session.commit()
-
-            flash(f'Successfully supplied {quantity} of {category.name} to {office.name}. Invoice {inv_num} ({fy}) generated.', 'success')
+            if request.is_json:
+                return jsonify({'category_id': category.id, 'invoices': results}), 201
+            numbers = ', '.join(result['invoice_number'] for result in results)
+            flash(f'Supplied {sum(line[1] for line in lines)} of {category.name} to {len(results)} offices. '
+                  f'Invoices {numbers} ({results[0]["financial_year"]}) generated.', 'success')
             return redirect(url_for('main.list_invoices'))
-
+        except InsufficientStockError as e:
+            db.session.rollback()
+            errors.append(f'Insufficient stock for {category.name}: the plan needs {e.requested}, available {e.available}.')
         except Exception as e:
             db.session.rollback()
-            flash(f'Error supplying stock: {e}', 'danger')
-            current_app.logger.error(f"Error supplying stock: {e}")
-            categories = StockCategory.query.order_by(StockCategory.name).all()
-            offices = Office.query.order_by(Office.name).all()
-            return render_template('supply_stock.html', 
-                                categories=categories, 
-                                offices=offices,
-                                selected_category=category_id, 
-                                selected_office=office_id,
-                                entered_quantity=quantity_str, 
-                                entered_date=transaction_date_str,
-                                serial_numbers=serial_numbers)
+            current_app.logger.error(f"Error distributing stock: {e}")
+            errors.append(f'Error distributing stock: {e}')
+
+    if request.is_json:
+        return jsonify({'errors': errors}), 400
+    for error in errors:
+        flash(error, 'danger')
+    return render_template('distribute_stock.html', categories=categories, offices=offices, form=request.form)
+
+# Errors shown on the import page; the rest are summarised
+MAX_IMPORT_ERRORS_SHOWN = 200
+
+@main_bp.route('/stock/import', methods=['GET', 'POST'])
+@query_budget(None)  # a few statements per category and invoice series, by design
+def import_stock():
+    """Import receipts or supplies from a CSV file: every row is validated first, then all are written in one transaction."""
+    kind = request.form.get('kind', 'receipts')
+    if kind not in IMPORT_COLUMNS:
+        kind = 'receipts'
+    errors = []
 
-    # GET Request
-    categories = StockCategory.query.order_by(StockCategory.name).all()
-    offices = Office.query.order_by(Office.name).all()
-    return render_template('supply_stock.html', categories=categories, offices=offices)
+    if request.method == 'POST':
+        upload = request.files.get('csv_file')
+        dry_run = bool(request.form.get('dry_run'))
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to import.', 'danger')
+        else:
+            try:
+                stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+                count = import_csv(kind, stream, dry_run=dry_run)
+                if dry_run:
+                    flash(f'All {count} rows are valid. Nothing was imported (check only).', 'info')
+                else:
+                    db.session.commit()
+                    flash(f'Imported {count} {kind}.', 'success')
+                    return redirect(url_for('main.list_invoices' if kind == 'supplies' else 'main.stock_report'))
+            except CsvImportError as e:
+                db.session.rollback()
+                errors = e.errors
+                flash(f'{len(errors)} problem(s) found. Nothing was imported.', 'danger')
+            except UnicodeDecodeError:
+                db.session.rollback()
+                flash('The file is not valid UTF-8 text. Save it as "CSV UTF-8" and try again.', 'danger')
+            except Exception as e:
+                db.session.rollback()
+                flash(f'Error importing stock: {e}', 'danger')
+                current_app.logger.error(f"Error importing stock: {e}")
+
+    return render_template('import_stock.html',
+                         kind=kind,
+                         columns=IMPORT_COLUMNS,
+                         required_columns=REQUIRED_COLUMNS,
+                         errors=errors[:MAX_IMPORT_ERRORS_SHOWN],
+                         error_count=len(errors))
 
 # --- Reports and Invoice Viewing ---
 
@@ -415,17 +555,206 @@ def stock_report():
     """Display current stock levels for all categories at the head office."""
     categories = StockCategory.query.order_by(StockCategory.name).all()
     # Optional: Query recent transactions for display
-    recent_transactions = StockTransaction.query.order_by(StockTransaction.transaction_date.desc()).limit(10).all()
+    recent_transactions = StockTransaction.query.options(
+        joinedload(StockTransaction.stock_category),
+        joinedload(StockTransaction.office),
+        joinedload(StockTransaction.invoice)
+    ).order_by(StockTransaction.transaction_date.desc()).limit(10).all()
     return render_template('stock_report.html', categories=categories, transactions=recent_transactions)
 
+@main_bp.route('/reports/stock-as-of')
+def stock_as_of_report():
+    """Head office stock per category at the end of a chosen date (e.g. financial year end)."""
+    today = datetime.utcnow().date()
+    # Closing date of the last completed financial year (31 March)
+    last_fy_end = date(today.year if today.month >= 4 else today.year - 1, 3, 31)
+    selected_date = request.args.get('date', today.strftime('%Y-%m-%d'))
+
+    try:
+        as_of = datetime.strptime(selected_date, '%Y-%m-%d').date()
+    except ValueError:
+        flash('Invalid date format. Please use YYYY-MM-DD.', 'danger')
+        return redirect(url_for('main.stock_as_of_report'))
+
+    # One snapshot per category, not a sum over all history
+    balances = stock_balances_as_of(as_of)
+    categories = StockCategory.query.order_by(StockCategory.name).all()
+    rows = [{'name': category.name, 'balance': balances.get(category.id, 0), 'current_stock': category.current_stock}
+            for category in categories]
+
+    return render_template('stock_as_of_report.html',
+                         selected_date=selected_date,
+                         last_fy_end=last_fy_end.strftime('%Y-%m-%d'),
+                         financial_year=get_financial_year(datetime.combine(as_of, datetime.min.time())),
+                         rows=rows,
+                         total_balance=sum(row['balance'] for row in rows))
+
+@main_bp.route('/reports/office-stock')
+def office_stock_report():
+    """What a sub-office has received, per category, in a financial year and in total."""
+    offices = cached_offices()
+    office_id = request.args.get('office_id', type=int)
+    if office_id is None and offices:
+        office_id = offices[0].id
+    financial_year = request.args.get('financial_year') or get_financial_year()
+
+    # Read from the maintained office_stock rows: one per category and year
+    holdings = office_holdings(office_id, financial_year) if office_id else []
+    financial_years = holding_financial_years()
+    if financial_year not in financial_years:
+        financial_years.insert(0, financial_year)
+
+    return render_template('office_stock_report.html',
+                         offices=offices,
+                         selected_office=office_id,
+                         financial_years=financial_years,
+                         selected_financial_year=financial_year,
+                         holdings=holdings,
+                         total_this_year=sum(row.received_this_year for row in holdings),
+                         total_all_time=sum(row.received_all_time for row in holdings))
+
+@main_bp.route('/serials')
+def serial_lookup():
+    """Where is serial X: every receipt and supply of a serial number (?format=json for the raw history)."""
+    serial = request.args.get('serial', '').strip()
+    history = serial_history(serial) if serial else []
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'serial': serial,
+            'movements': [{
+                'date': row.transaction_date.isoformat(),
+                'type': row.transaction_type,
+                'category': row.category_name,
+                'office': row.office_name,
+                'invoice_id': row.invoice_id,
+                'invoice_number': row.invoice_number,
+                'acknowledgment_status': row.acknowledgment_status,
+                'reference': row.reference_invoice,
+            } for row in history]
+        })
+
+    return render_template('serial_lookup.html', serial=serial, history=history)
+
+@main_bp.route('/search')
+def search_records():
+    """Full-text search over invoice numbers, references, serial numbers and notes."""
+    q = request.args.get('q', '').strip()
+    transactions, invoices = [], []
+    if q:
+        try:
+            transactions, invoices = search(q)
+        except SearchUnavailable:
+            flash('Search index not found. Run "flask db upgrade" (or "flask rebuild-search-index").', 'warning')
+
+    return render_template('search.html', q=q, transactions=transactions, invoices=invoices)
+
 @main_bp.route('/invoice/<int:invoice_id>/pdf')
 def view_invoice_pdf(invoice_id):
     """Generate and return the PDF for a specific invoice."""
     invoice = db.session.get(Invoice, invoice_id)
     if not invoice:
         abort(404, description="Invoice not found")
-    pdf_response = generate_invoice_pdf(invoice)
-    return pdf_response
+
+    if async_rendering_enabled():
+        # Serve the finished PDF if a worker already rendered it, otherwise queue it
+        cache = get_pdf_cache()
+        data = cache.get(invoice_pdf_cache_key(invoice))
+        if data is not None:
+            return pdf_response(data, invoice.invoice_number)
+        job_id = enqueue_invoice_pdf(invoice)
+        return render_template('pdf_pending.html', invoice=invoice, job_id=job_id), 202
+
+    return generate_invoice_pdf(invoice)
+
+@main_bp.route('/pdf-jobs/<job_id>')
+def pdf_job_status(job_id):
+    """Status of a background PDF render job, for polling."""
+    status, detail = job_status(job_id)
+    result = {'job_id': job_id, 'status': status}
+    if status == 'done':
+        result['pdf_url'] = url_for('main.view_invoice_pdf', invoice_id=int(job_id.split('-', 1)[0]))
+    elif status == 'failed':
+        result['error'] = detail
+    return jsonify(result), 404 if status == 'unknown' else 200
+
+@main_bp.route('/invoice/pdf-cache/stats')
+def pdf_cache_stats():
+    """Hit/miss counters and size of the invoice PDF cache, across all workers."""
+    cache = get_pdf_cache()
+    if not cache:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **cache.stats()})
+
+@main_bp.route('/metrics')
+def metrics():
+    """Request, SQL and PDF render metrics of all workers, in Prometheus text format."""
+    if not metrics_enabled():
+        abort(404)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def _cursor_paging():
+    """Whether listings use keyset (cursor) pages; ?paging=cursor|offset overrides PAGINATION_MODE."""
+    return request.args.get('paging', current_app.config['PAGINATION_MODE']) == 'cursor'
+
+def _keyset_page(query, order_col, id_col, sort_order, per_page):
+    """Cursor-mode page of an unordered query; a cursor that cannot be read restarts at the first page."""
+    options = dict(descending=sort_order != 'asc', per_page=per_page,
+                   count_limit=current_app.config['PAGINATION_COUNT_LIMIT'])
+    try:
+        return keyset_paginate(query, order_col, id_col, cursor=request.args.get('cursor'),
+                               direction=request.args.get('direction', 'next'), **options)
+    except InvalidCursor:
+        flash('Invalid page link. Showing the first page.', 'warning')
+        return keyset_paginate(query, order_col, id_col, **options)
+
+def _sorted(query, order_col, id_col, sort_order):
+    """Orders query by order_col then id, both ascending or both descending."""
+    if sort_order == 'asc':
+        return query.order_by(order_col.asc(), id_col.asc())
+    return query.order_by(order_col.desc(), id_col.desc())
+
+def _invoice_filters():
+    """Reads the list_invoices filter parameters from the query string."""
+    return {
+        'from_date': request.args.get('from_date', (datetime.utcnow().replace(day=1)).strftime('%Y-%m-%d')),
+        'to_date': request.args.get('to_date', datetime.utcnow().strftime('%Y-%m-%d')),
+        'category_id': request.args.get('category_id', type=int),
+        'office_id': request.args.get('office_id', type=int),
+        'acknowledgment_status': request.args.get('acknowledgment_status'),
+    }
+
+def _apply_invoice_filters(query, filters):
+    """Applies the list_invoices filters (date range, category, office, status) to an Invoice query."""
+    try:
+        from_date_obj = datetime.strptime(filters['from_date'], '%Y-%m-%d')
+        to_date_obj = datetime.strptime(filters['to_date'], '%Y-%m-%d')
+        query = query.filter(Invoice.date.between(
+            from_date_obj, to_date_obj + timedelta(days=1)
+        ))
+    except ValueError:
+        flash('Invalid date format. Using default date range.', 'warning')
+
+    if filters['category_id']:
+        # Any invoice with a line of the category
+        query = query.filter(Invoice.lines.any(InvoiceLine.stock_category_id == filters['category_id']))
+    if filters['office_id']:
+        query = query.filter(Invoice.office_id == filters['office_id'])
+    if filters['acknowledgment_status']:
+        query = query.filter(Invoice.acknowledgment_status == filters['acknowledgment_status'])
+    return query
+
+# Loads invoice lines and their categories in one extra SELECT per page (or batch)
+LOAD_INVOICE_LINES = selectinload(Invoice.lines).joinedload(InvoiceLine.stock_category)
+
+# list_invoices sort options; office and category need the joined tables
+INVOICE_SORT_COLUMNS = {
+    'created_at': Invoice.created_at,
+    'invoice_number': Invoice.invoice_number,
+    'quantity': Invoice.quantity,
+    'office': Office.name,
+    'category': StockCategory.name,
+}
 
 @main_bp.route('/invoices')
 def list_invoices():
@@ -434,118 +763,254 @@ def list_invoices():
     per_page = 15
 
     # Get filter parameters
-    from_date = request.args.get('from_date', (datetime.utcnow().replace(day=1)).strftime('%Y-%m-%d'))
-    to_date = request.args.get('to_date', datetime.utcnow().strftime('%Y-%m-%d'))
-    category_id = request.args.get('category_id', type=int)
-    office_id = request.args.get('office_id', type=int)
-    acknowledgment_status = request.args.get('acknowledgment_status')
+    filters = _invoice_filters()
     sort_by = request.args.get('sort_by', 'created_at')
     sort_order = request.args.get('sort_order', 'desc')
 
-    # Base query
-    query = Invoice.query
-
-    # Apply filters
-    try:
-        from_date_obj = datetime.strptime(from_date, '%Y-%m-%d')
-        to_date_obj = datetime.strptime(to_date, '%Y-%m-%d')
-        query = query.filter(Invoice.date.between(
-            from_date_obj, to_date_obj + timedelta(days=1)
-        ))
-    except ValueError:
-        flash('Invalid date format. Using default date range.', 'warning')
-
-    if category_id:
-        query = query.filter_by(stock_category_id=category_id)
-    if office_id:
-        query = query.filter_by(office_id=office_id)
-    if acknowledgment_status:
-        query = query.filter_by(acknowledgment_status=acknowledgment_status)
+    # Base query with filters applied; office names load in the same SELECT, lines in one more
+    query = _apply_invoice_filters(Invoice.query.options(
+        joinedload(Invoice.office), LOAD_INVOICE_LINES
+    ), filters)
 
     # Apply sorting
-    if sort_by == 'created_at':
-        order_col = Invoice.created_at
-    elif sort_by == 'invoice_number':
-        order_col = Invoice.invoice_number
-    elif sort_by == 'quantity':
-        order_col = Invoice.quantity
-    elif sort_by == 'office':
-        order_col = Office.name
+    order_col = INVOICE_SORT_COLUMNS.get(sort_by, Invoice.created_at)
+    if sort_by == 'office':
         query = query.join(Office)
     elif sort_by == 'category':
-        order_col = StockCategory.name
         query = query.join(StockCategory)
-    else:
-        order_col = Invoice.created_at
 
-    if sort_order == 'asc':
-        query = query.order_by(order_col.asc())
+    if _cursor_paging():
+        # Keyset pages: no OFFSET and no full COUNT(*), however deep the page
+        invoices_pagination = _keyset_page(query, order_col, Invoice.id, sort_order, per_page)
     else:
-        query = query.order_by(order_col.desc())
+        # Id breaks ties so rows with equal sort values keep their page
+        query = _sorted(query, order_col, Invoice.id, sort_order)
 
-    # Execute query with pagination
-    invoices_pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Execute query with pagination
+        invoices_pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
     # Get categories and offices for filters
-    categories = StockCategory.query.order_by(StockCategory.name).all()
-    offices = Office.query.order_by(Office.name).all()
+    categories = cached_categories()
+    offices = cached_offices()
 
     return render_template('list_invoices.html',
                          invoices_pagination=invoices_pagination,
                          categories=categories,
                          offices=offices,
-                         from_date=from_date,
-                         to_date=to_date,
-                         selected_category=category_id,
-                         selected_office=office_id,
-                         selected_status=acknowledgment_status,
+                         from_date=filters['from_date'],
+                         to_date=filters['to_date'],
+                         selected_category=filters['category_id'],
+                         selected_office=filters['office_id'],
+                         selected_status=filters['acknowledgment_status'],
                          sort_by=sort_by,
-                         sort_order=sort_order)
+                         sort_order=sort_order,
+                         paging='cursor' if _cursor_paging() else 'offset')
+
+@main_bp.route('/invoices/export/pdf')
+def export_invoice_pdfs():
+    """Download every invoice matching the list_invoices filters as a ZIP of PDFs or one merged PDF."""
+    output = request.args.get('format', 'zip')
+    if output not in ('zip', 'pdf'):
+        abort(400, description="format must be 'zip' or 'pdf'")
+
+    filters = _invoice_filters()
+    query = _apply_invoice_filters(Invoice.query, filters)
+    # A merged PDF is held whole until its last page is in; only the ZIP streams in constant memory
+    merge_limit = current_app.config['PDF_MERGE_MAX_INVOICES']
+    if output == 'pdf' and merge_limit and query.order_by(None).count() > merge_limit:
+        abort(400, description=f"A merged PDF is limited to {merge_limit} invoices; "
+                               "narrow the filters or download them with format=zip")
+    query = query.options(
+        joinedload(Invoice.office), LOAD_INVOICE_LINES
+    ).order_by(Invoice.date, Invoice.id)
+    # PDFs are rendered in parallel and streamed out as they finish, in date order
+    invoice_pdfs = iter_invoice_pdfs(query.yield_per(100))
+
+    filename = f"invoices_{filters['from_date']}_to_{filters['to_date']}"
+    if output == 'zip':
+        body, mimetype, filename = stream_pdf_zip(invoice_pdfs), 'application/zip', f'{filename}.zip'
+    else:
+        body, mimetype, filename = stream_merged_pdf(invoice_pdfs), 'application/pdf', f'{filename}.pdf'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+def _table_download(output, header, rows, filename, sheet_name):
+    """Streams header plus rows as a CSV or XLSX attachment."""
+    mimetype, extension = EXPORT_FORMATS[output]
+    body = stream_csv(header, rows) if output == 'csv' else stream_xlsx(header, rows, sheet_name)
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{extension}'})
+
+@main_bp.route('/invoices/export')
+def export_invoices():
+    """Download every invoice matching the list_invoices filters and sort as CSV or XLSX."""
+    output = request.args.get('format', 'csv')
+    if output not in EXPORT_FORMATS:
+        abort(400, description="format must be 'csv' or 'xlsx'")
+
+    filters = _invoice_filters()
+    # Plain tuples with the names joined in, read in batches off the cursor:
+    # no ORM objects kept around, so memory stays flat for a full year
+    # One row per invoice line
+    query = db.session.query(
+        Invoice.invoice_number, Invoice.date, Invoice.created_at, Invoice.financial_year,
+        Office.name, StockCategory.name, InvoiceLine.quantity, Invoice.acknowledgment_status,
+        Invoice.acknowledgment_date, Invoice.acknowledgment_note, InvoiceLine.serial_numbers
+    ).select_from(Invoice).join(
+        Office, Invoice.office_id == Office.id
+    ).join(
+        InvoiceLine, InvoiceLine.invoice_id == Invoice.id
+    ).join(
+        StockCategory, InvoiceLine.stock_category_id == StockCategory.id
+    )
+    query = _apply_invoice_filters(query, filters)
+    order_col = INVOICE_SORT_COLUMNS.get(request.args.get('sort_by'), Invoice.created_at)
+    rows = _sorted(query, order_col, Invoice.id, request.args.get('sort_order', 'desc')).order_by(
+        InvoiceLine.id
+    ).yield_per(1000)
+
+    header = ['Invoice #', 'Transaction Date', 'Created On', 'FY', 'Sub-Office', 'Stock Category',
+              'Quantity', 'Status', 'Acknowledged On', 'Acknowledgment Note', 'Serial Numbers']
+    return _table_download(output, header, rows,
+                           f"invoices_{filters['from_date']}_to_{filters['to_date']}", 'Invoices')
+
+@main_bp.route('/reports/transactions/export')
+def export_transactions():
+    """Download every transaction matching the transaction_report filters and sort as CSV or XLSX."""
+    output = request.args.get('format', 'csv')
+    if output not in EXPORT_FORMATS:
+        abort(400, description="format must be 'csv' or 'xlsx'")
+
+    filters = _transaction_filters()
+    # Plain tuples with the names joined in, read in batches off the cursor
+    query = db.session.query(
+        StockTransaction.transaction_date, StockTransaction.transaction_type, StockCategory.name,
+        func.abs(StockTransaction.quantity), func.coalesce(Office.name, 'Head Office'),
+        func.coalesce(Invoice.invoice_number, StockTransaction.reference_invoice),
+        StockTransaction.serial_numbers, StockTransaction.notes
+    ).select_from(StockTransaction).join(
+        StockCategory, StockTransaction.stock_category_id == StockCategory.id
+    ).outerjoin(
+        Office, StockTransaction.office_id == Office.id
+    ).outerjoin(
+        Invoice, StockTransaction.invoice_id == Invoice.id
+    )
+    query = _apply_transaction_filters(query, filters)
+    order_col = TRANSACTION_SORT_COLUMNS.get(request.args.get('sort_by'), StockTransaction.transaction_date)
+    rows = _sorted(query, order_col, StockTransaction.id, request.args.get('sort_order', 'desc')).yield_per(1000)
+
+    header = ['Date', 'Type', 'Category', 'Quantity', 'Office', 'Invoice/Ref', 'Serial Numbers', 'Notes']
+    return _table_download(output, header, rows,
+                           f"transactions_{filters['from_date']}_to_{filters['to_date']}", 'Transactions')
+
+MAX_SUPPLY_REPORT_DAYS = 31
 
 @main_bp.route('/daily-supply-report')
 def daily_supply_report():
-    """Show supplies made on a particular day."""
+    """Show supplies made on a particular day, or per day over a date range."""
     selected_date = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    end_date = request.args.get('end_date', '')
     
     try:
-        # Parse the selected date
+        # Parse the selected date (and the optional last day of the range)
         date_obj = datetime.strptime(selected_date, '%Y-%m-%d')
-        
-        # Query invoices for the selected date
-        invoices = Invoice.query.filter(
-            func.date(Invoice.created_at) == date_obj.date()
-        ).order_by(Invoice.created_at.desc()).all()
-        
-        # Calculate summary by category
-        summary = []
-        if invoices:
-            # Create a dictionary to store totals by category
-            category_totals = {}
-            for invoice in invoices:
-                if invoice.stock_category not in category_totals:
-                    category_totals[invoice.stock_category] = 0
-                category_totals[invoice.stock_category] += invoice.quantity
-            
-            # Convert to list for template
-            summary = [{'name': cat.name, 'total_quantity': total} 
-                      for cat, total in category_totals.items()]
-            # Sort by category name
-            summary.sort(key=lambda x: x['name'])
-        
-        return render_template('daily_supply_report.html', 
-                             selected_date=selected_date,
-                             invoices=invoices,
-                             summary=summary)
-                             
+        end_obj = datetime.strptime(end_date, '%Y-%m-%d') if end_date else date_obj
     except ValueError:
         flash('Invalid date format. Please use YYYY-MM-DD.', 'danger')
         return redirect(url_for('main.daily_supply_report'))
 
+    if end_obj < date_obj:
+        flash('End date must not be before the start date.', 'danger')
+        return redirect(url_for('main.daily_supply_report', date=selected_date))
+    if (end_obj - date_obj).days >= MAX_SUPPLY_REPORT_DAYS:
+        flash(f'Please choose a range of at most {MAX_SUPPLY_REPORT_DAYS} days.', 'warning')
+        end_obj = date_obj + timedelta(days=MAX_SUPPLY_REPORT_DAYS - 1)
+        end_date = end_obj.strftime('%Y-%m-%d')
+    multi_day = end_obj > date_obj
+
+    # Half-open range on the raw column, so the created_at index can be used
+    # (func.date(created_at) == day would have to scan every invoice)
+    in_range = [Invoice.created_at >= date_obj, Invoice.created_at < end_obj + timedelta(days=1)]
+
+    # Invoices for the selected day(s), with office loaded in the same query and lines in one more
+    invoices = Invoice.query.options(
+        joinedload(Invoice.office), LOAD_INVOICE_LINES
+    ).filter(*in_range).order_by(Invoice.created_at.desc()).all()
+
+    # Totals per day and category in one GROUP BY; the per-day subtotals and the
+    # category summary are folded from these few rows
+    day = func.date(Invoice.created_at).label('day')
+    totals = db.session.query(
+        day, StockCategory.name, func.sum(InvoiceLine.quantity)
+    ).select_from(Invoice).join(
+        InvoiceLine, InvoiceLine.invoice_id == Invoice.id
+    ).join(StockCategory, InvoiceLine.stock_category_id == StockCategory.id).filter(
+        *in_range
+    ).group_by(day, StockCategory.id).order_by(day, StockCategory.name).all()
+
+    category_totals = {}
+    days = []
+    for day_str, category_name, total in totals:
+        if not days or days[-1]['date'] != day_str:
+            days.append({'date': day_str, 'categories': [], 'total_quantity': 0})
+        days[-1]['categories'].append({'name': category_name, 'total_quantity': total})
+        days[-1]['total_quantity'] += total
+        category_totals[category_name] = category_totals.get(category_name, 0) + total
+
+    # Sorted by category name for the template
+    summary = [{'name': name, 'total_quantity': total}
+               for name, total in sorted(category_totals.items())]
+
+    return render_template('daily_supply_report.html', 
+                         selected_date=selected_date,
+                         end_date=end_date,
+                         multi_day=multi_day,
+                         invoices=invoices,
+                         summary=summary,
+                         days=days)
+
+ACKNOWLEDGMENT_STATUSES = ('PENDING', 'ACKNOWLEDGED')
+
 @main_bp.route('/acknowledgments')
 def pending_acknowledgments():
-    """Display invoices with their acknowledgment status."""
-    invoices = Invoice.query.order_by(Invoice.date.desc()).all()
-    return render_template('pending_acknowledgments.html', invoices=invoices)
+    """Display one page of invoices for the selected acknowledgment status tab."""
+    status = request.args.get('status', 'PENDING')
+    if status not in ACKNOWLEDGMENT_STATUSES:
+        status = 'PENDING'
+    page = request.args.get('page', 1, type=int)
+    per_page = 20
+
+    # Per-tab counts in one GROUP BY (served by the status/date index)
+    counts = dict.fromkeys(ACKNOWLEDGMENT_STATUSES, 0)
+    counts.update(db.session.query(
+        Invoice.acknowledgment_status, func.count(Invoice.id)
+    ).group_by(Invoice.acknowledgment_status).all())
+
+    query = Invoice.query.options(
+        joinedload(Invoice.office), LOAD_INVOICE_LINES
+    ).filter(
+        Invoice.acknowledgment_status == status
+    ).order_by(Invoice.date.desc(), Invoice.id.desc())
+    # The tab count is the total, so skip paginate()'s own COUNT query
+    invoices_pagination = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    invoices_pagination.total = counts[status]
+
+    return render_template('pending_acknowledgments.html',
+                         invoices_pagination=invoices_pagination,
+                         status=status,
+                         counts=counts,
+                         offices=cached_offices() if status == 'PENDING' else [])
+
+def _redirect_to_acknowledgments():
+    """Back to the acknowledgments tab and page the form was submitted from."""
+    return redirect(url_for('main.pending_acknowledgments',
+                            status=request.form.get('return_status', 'PENDING'),
+                            page=request.form.get('return_page', 1, type=int)))
 
 @main_bp.route('/acknowledge-invoice/<int:invoice_id>', methods=['POST'])
 def acknowledge_invoice(invoice_id):
@@ -553,21 +1018,101 @@ def acknowledge_invoice(invoice_id):
     invoice = db.session.get(Invoice, invoice_id)
     if not invoice:
         flash('Invoice not found.', 'danger')
-        return redirect(url_for('main.pending_acknowledgments'))
+        return _redirect_to_acknowledgments()
 
     note = request.form.get('acknowledgment_note', '')
-    invoice.acknowledgment_status = 'ACKNOWLEDGED'
-    invoice.acknowledgment_date = datetime.utcnow()
-    invoice.acknowledgment_note = note
 
     try:
+        set_acknowledgment_status([invoice.id], 'ACKNOWLEDGED', note)
         db.session.commit()
+        invalidate_invoice_pdf(invoice.id)
         flash(f'Invoice #{invoice.invoice_number} has been acknowledged successfully.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error acknowledging invoice: {str(e)}', 'danger')
 
-    return redirect(url_for('main.pending_acknowledgments'))
+    return _redirect_to_acknowledgments()
+
+def _bulk_acknowledgment_request():
+    """
+    Reads a bulk acknowledgment from a JSON body or the form: either
+    invoice_ids, or office_id with from_date and to_date (YYYY-MM-DD), plus
+    an optional acknowledgment_note and acknowledgment_date.
+    Returns (criteria on Invoice, note, acknowledged_at, errors).
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        invoice_ids = data.get('invoice_ids') or []
+    else:
+        data = request.form
+        invoice_ids = request.form.getlist('invoice_ids')
+
+    errors = []
+    criteria = []
+    try:
+        acknowledged_at = datetime.strptime(data['acknowledgment_date'], '%Y-%m-%d') if data.get('acknowledgment_date') else None
+    except (ValueError, TypeError):
+        acknowledged_at = None
+        errors.append('Invalid acknowledgment date. Please use YYYY-MM-DD.')
+
+    if data.get('office_id'):
+        try:
+            office_id = int(data['office_id'])
+            from_date = datetime.strptime(data.get('from_date') or '', '%Y-%m-%d')
+            to_date = datetime.strptime(data.get('to_date') or '', '%Y-%m-%d')
+        except (ValueError, TypeError):
+            errors.append('Choose an office and a valid date range (YYYY-MM-DD).')
+        else:
+            # Half-open range on the raw column, so the office/date index can be used
+            criteria = [Invoice.office_id == office_id, Invoice.date >= from_date,
+                        Invoice.date < to_date + timedelta(days=1)]
+    else:
+        try:
+            invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+        except (ValueError, TypeError):
+            errors.append('Invalid invoice selection.')
+            invoice_ids = []
+        if invoice_ids:
+            criteria = [Invoice.id.in_(invoice_ids)]
+        elif not errors:
+            errors.append('Select at least one invoice to acknowledge.')
+
+    return criteria, (data.get('acknowledgment_note') or '').strip(), acknowledged_at, errors
+
+@main_bp.route('/acknowledgments/bulk', methods=['POST'])
+def bulk_acknowledge():
+    """
+    Acknowledge many pending invoices at once (the selected ones, or all of an
+    office's in a date range) with one UPDATE and one commit. JSON requests
+    get the acknowledged count back as JSON.
+    """
+    criteria, note, acknowledged_at, errors = _bulk_acknowledgment_request()
+    if errors:
+        if request.is_json:
+            return jsonify({'errors': errors}), 400
+        for error in errors:
+            flash(error, 'danger')
+        return _redirect_to_acknowledgments()
+
+    try:
+        acknowledged_ids = acknowledge_pending(criteria, note, acknowledged_at)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error acknowledging invoices: {e}")
+        if request.is_json:
+            return jsonify({'errors': [f'Error acknowledging invoices: {e}']}), 500
+        flash(f'Error acknowledging invoices: {str(e)}', 'danger')
+        return _redirect_to_acknowledgments()
+
+    invalidate_invoice_pdfs(acknowledged_ids)
+    if request.is_json:
+        return jsonify({'acknowledged': len(acknowledged_ids), 'invoice_ids': acknowledged_ids})
+    if acknowledged_ids:
+        flash(f'{len(acknowledged_ids)} invoice(s) acknowledged.', 'success')
+    else:
+        flash('No pending invoices matched; nothing was acknowledged.', 'info')
+    return _redirect_to_acknowledgments()
 
 @main_bp.route('/modify-acknowledgment/<int:invoice_id>', methods=['POST'])
 def modify_acknowledgment(invoice_id):
@@ -575,96 +1120,114 @@ def modify_acknowledgment(invoice_id):
     invoice = db.session.get(Invoice, invoice_id)
     if not invoice:
         flash('Invoice not found.', 'danger')
-        return redirect(url_for('main.pending_acknowledgments'))
+        return _redirect_to_acknowledgments()
 
     new_status = request.form.get('acknowledgment_status')
     new_note = request.form.get('acknowledgment_note', '')
 
     if new_status not in ['PENDING', 'ACKNOWLEDGED']:
         flash('Invalid acknowledgment status.', 'danger')
-        return redirect(url_for('main.pending_acknowledgments'))
+        return _redirect_to_acknowledgments()
 
     try:
-        invoice.acknowledgment_status = new_status
-        invoice.acknowledgment_note = new_note
-        
-        # Update acknowledgment date only when changing to ACKNOWLEDGED
-        if new_status == 'ACKNOWLEDGED':
-            invoice.acknowledgment_date = datetime.utcnow()
-        elif new_status == 'PENDING':
-            invoice.acknowledgment_date = None
-
+        # Sets the acknowledgment date for ACKNOWLEDGED, clears it for PENDING
+        set_acknowledgment_status([invoice.id], new_status, new_note)
         db.session.commit()
+        invalidate_invoice_pdf(invoice.id)
         flash(f'Invoice #{invoice.invoice_number} acknowledgment status has been updated.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error updating acknowledgment: {str(e)}', 'danger')
 
-    return redirect(url_for('main.pending_acknowledgments'))
-
-@main_bp.route('/reports/transactions', methods=['GET'])
-def transaction_report():
-    """Comprehensive transaction report with filters and sorting."""
-    # Get filter parameters
-    from_date = request.args.get('from_date', (datetime.utcnow().replace(day=1)).strftime('%Y-%m-%d'))
-    to_date = request.args.get('to_date', datetime.utcnow().strftime('%Y-%m-%d'))
-    category_id = request.args.get('category_id', type=int)
-    office_id = request.args.get('office_id', type=int)
-    transaction_type = request.args.get('transaction_type')
-    sort_by = request.args.get('sort_by', 'transaction_date')
-    sort_order = request.args.get('sort_order', 'desc')
+    return _redirect_to_acknowledgments()
 
-    # Base query
-    query = StockTransaction.query
+def _transaction_filters():
+    """Reads the transaction_report filter parameters from the query string."""
+    return {
+        'from_date': request.args.get('from_date', (datetime.utcnow().replace(day=1)).strftime('%Y-%m-%d')),
+        'to_date': request.args.get('to_date', datetime.utcnow().strftime('%Y-%m-%d')),
+        'category_id': request.args.get('category_id', type=int),
+        'office_id': request.args.get('office_id', type=int),
+        'transaction_type': request.args.get('transaction_type'),
+    }
 
-    # Apply filters
+def _apply_transaction_filters(query, filters):
+    """Applies the transaction_report filters (date range, category, office, type) to a StockTransaction query."""
     try:
-        from_date_obj = datetime.strptime(from_date, '%Y-%m-%d')
-        to_date_obj = datetime.strptime(to_date, '%Y-%m-%d')
+        from_date_obj = datetime.strptime(filters['from_date'], '%Y-%m-%d')
+        to_date_obj = datetime.strptime(filters['to_date'], '%Y-%m-%d')
         query = query.filter(StockTransaction.transaction_date.between(
             from_date_obj, to_date_obj + timedelta(days=1)
         ))
     except ValueError:
         flash('Invalid date format. Using default date range.', 'warning')
 
-    if category_id:
-        query = query.filter_by(stock_category_id=category_id)
-    if office_id:
-        query = query.filter_by(office_id=office_id)
-    if transaction_type:
-        query = query.filter_by(transaction_type=transaction_type)
+    if filters['category_id']:
+        query = query.filter(StockTransaction.stock_category_id == filters['category_id'])
+    if filters['office_id']:
+        query = query.filter(StockTransaction.office_id == filters['office_id'])
+    if filters['transaction_type']:
+        query = query.filter(StockTransaction.transaction_type == filters['transaction_type'])
+    return query
+
+# transaction_report sort options; category and office need the joined tables
+TRANSACTION_SORT_COLUMNS = {
+    'transaction_date': StockTransaction.transaction_date,
+    'quantity': StockTransaction.quantity,
+    'category': StockCategory.name,
+    # Head office receipts have no office; sort them under the name they are shown with
+    'office': func.coalesce(Office.name, 'Head Office'),
+}
 
-    # Apply sorting
-    if sort_by == 'transaction_date':
-        order_col = StockTransaction.transaction_date
-    elif sort_by == 'quantity':
-        order_col = StockTransaction.quantity
-    elif sort_by == 'category':
-        order_col = StockCategory.name
-    elif sort_by == 'office':
-        order_col = Office.name
-    else:
-        order_col = StockTransaction.transaction_date
+@main_bp.route('/reports/transactions', methods=['GET'])
+def transaction_report():
+    """Comprehensive transaction report with filters and sorting."""
+    # Get filter parameters
+    filters = _transaction_filters()
+    from_date, to_date = filters['from_date'], filters['to_date']
+    category_id, office_id = filters['category_id'], filters['office_id']
+    transaction_type = filters['transaction_type']
+    sort_by = request.args.get('sort_by', 'transaction_date')
+    sort_order = request.args.get('sort_order', 'desc')
 
-    if sort_order == 'asc':
-        query = query.order_by(order_col.asc())
-    else:
-        query = query.order_by(order_col.desc())
+    # Base query with filters applied; the names shown per row load in the same SELECT
+    query = _apply_transaction_filters(StockTransaction.query.options(
+        joinedload(StockTransaction.stock_category),
+        joinedload(StockTransaction.office),
+        joinedload(StockTransaction.invoice)
+    ), filters)
+
+    # Apply sorting
+    order_col = TRANSACTION_SORT_COLUMNS.get(sort_by, StockTransaction.transaction_date)
 
     # Add joins for sorting if needed
     if sort_by == 'category':
         query = query.join(StockCategory)
     elif sort_by == 'office':
-        query = query.join(Office)
+        query = query.outerjoin(Office)
 
-    # Execute query with pagination
-    page = request.args.get('page', 1, type=int)
     per_page = 20
-    transactions = query.paginate(page=page, per_page=per_page, error_out=False)
+    if _cursor_paging():
+        # Keyset pages: no OFFSET and no full COUNT(*), however deep the page
+        transactions = _keyset_page(query, order_col, StockTransaction.id, sort_order, per_page)
+    else:
+        # Id breaks ties so rows with equal sort values keep their page
+        query = _sorted(query, order_col, StockTransaction.id, sort_order)
+
+        # Execute query with pagination
+        page = request.args.get('page', 1, type=int)
+        transactions = query.paginate(page=page, per_page=per_page, error_out=False)
+
+    # Filter and sort parameters for the page links
+    filter_args = {
+        'from_date': from_date, 'to_date': to_date, 'category_id': category_id,
+        'office_id': office_id, 'transaction_type': transaction_type,
+        'sort_by': sort_by, 'sort_order': sort_order,
+    }
 
     # Get categories and offices for filters
-    categories = StockCategory.query.order_by(StockCategory.name).all()
-    offices = Office.query.order_by(Office.name).all()
+    categories = cached_categories()
+    offices = cached_offices()
 
     return render_template('transaction_report.html',
                          transactions=transactions,
@@ -676,7 +1239,17 @@ def transaction_report():
                          selected_office=office_id,
                          selected_type=transaction_type,
                          sort_by=sort_by,
-                         sort_order=sort_order)
+                         sort_order=sort_order,
+                         filter_args=filter_args,
+                         paging='cursor' if _cursor_paging() else 'offset')
+
+# Period buckets for the stock movement report, as SQLite expressions over the
+# transaction date; weeks start on Monday and are labelled by that date
+MOVEMENT_GRANULARITIES = {
+    'day': lambda col: func.date(col),
+    'week': lambda col: func.date(col, 'weekday 0', '-6 days'),
+    'month': lambda col: func.strftime('%Y-%m', col),
+}
 
 @main_bp.route('/reports/stock-movement')
 def stock_movement_report():
@@ -685,6 +1258,9 @@ def stock_movement_report():
     from_date = request.args.get('from_date', (datetime.utcnow().replace(day=1)).strftime('%Y-%m-%d'))
     to_date = request.args.get('to_date', datetime.utcnow().strftime('%Y-%m-%d'))
     category_id = request.args.get('category_id', type=int)
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in MOVEMENT_GRANULARITIES:
+        granularity = 'day'
 
     try:
         from_date_obj = datetime.strptime(from_date, '%Y-%m-%d')
@@ -694,13 +1270,15 @@ def stock_movement_report():
         from_date_obj = datetime.utcnow().replace(day=1)
         to_date_obj = datetime.utcnow()
 
-    # Base query for movements
+    period = MOVEMENT_GRANULARITIES[granularity](StockTransaction.transaction_date).label('period')
+
+    # Base query for movements, one row per period, category and office
     movements = db.session.query(
         StockCategory.name.label('category_name'),
         func.sum(case((StockTransaction.transaction_type == 'IN', StockTransaction.quantity), else_=0)).label('total_in'),
         func.sum(case((StockTransaction.transaction_type == 'OUT', -StockTransaction.quantity), else_=0)).label('total_out'),
         Office.name.label('office_name'),
-        func.date(StockTransaction.transaction_date).label('date')
+        period
     ).join(
         StockCategory,
         StockTransaction.stock_category_id == StockCategory.id
@@ -708,27 +1286,54 @@ def stock_movement_report():
         Office,
         StockTransaction.office_id == Office.id
     ).filter(
-        StockTransaction.transaction_date.between(from_date_obj, to_date_obj + timedelta(days=1))
+        StockTransaction.transaction_date >= from_date_obj,
+        StockTransaction.transaction_date < to_date_obj + timedelta(days=1)
     )
 
     if category_id:
         movements = movements.filter(StockTransaction.stock_category_id == category_id)
 
     movements = movements.group_by(
-        'category_name',
-        'office_name',
-        'date'
+        period,
+        StockCategory.id,
+        Office.id
     ).order_by(
-        'date',
-        'category_name'
+        period,
+        'category_name',
+        'office_name'
     ).all()
 
+    # Category totals, office totals and the grand total in one pass over the
+    # grouped rows (the template used to rescan every row for every row)
+    category_totals = {}
+    office_totals = {}
+    grand_total = {'total_in': 0, 'total_out': 0}
+    for movement in movements:
+        totals = category_totals.setdefault(movement.category_name, {'total_in': 0, 'total_out': 0})
+        totals['total_in'] += movement.total_in
+        totals['total_out'] += movement.total_out
+        if movement.office_name:
+            office_totals[movement.office_name] = office_totals.get(movement.office_name, 0) + movement.total_out
+        grand_total['total_in'] += movement.total_in
+        grand_total['total_out'] += movement.total_out
+
+    category_summary = [{'name': name, 'total_in': totals['total_in'], 'total_out': totals['total_out'],
+                         'net_change': totals['total_in'] - totals['total_out']}
+                        for name, totals in sorted(category_totals.items())]
+    office_summary = [{'name': name, 'total_received': total}
+                      for name, total in sorted(office_totals.items())]
+    grand_total['net_change'] = grand_total['total_in'] - grand_total['total_out']
+
     # Get categories for filter
-    categories = StockCategory.query.order_by(StockCategory.name).all()
+    categories = cached_categories()
 
     return render_template('stock_movement_report.html',
                          movements=movements,
+                         category_summary=category_summary,
+                         office_summary=office_summary,
+                         grand_total=grand_total,
                          categories=categories,
                          from_date=from_date,
                          to_date=to_date,
-                         selected_category=category_id)
\ No newline at end of file
+                         selected_category=category_id,
+                         granularity=granularity)
@@ -0,0 +1,111 @@
+"""Full-text search over transactions and invoices (SQLite FTS5).
+
+stock_transaction_fts and invoice_fts are external-content FTS5 tables: they
+index the text columns of stock_transaction and invoice without a second copy
+of the text, and triggers keep them in step with every INSERT, UPDATE and
+DELETE, whether it comes from the ORM or a bulk UPDATE. The tables and
+triggers are created by a migration; `flask rebuild-search-index` creates them
+if missing and reindexes everything.
+"""
+from markupsafe import Markup, escape
+from sqlalchemy import text, DateTime
+from sqlalchemy.exc import OperationalError
+from .models import db
+
+# '-', '_' and '/' are part of tokens, so serials and references such as
+# AB-1023 or INV/2024/17 are indexed (and matched) as single words
+TOKENIZE = "unicode61 tokenchars '-_/'"
+
+# (fts table, content table, indexed columns)
+SEARCH_TABLES = [
+    ('stock_transaction_fts', 'stock_transaction', ('reference_invoice', 'notes', 'serial_numbers')),
+    ('invoice_fts', 'invoice', ('invoice_number', 'serial_numbers', 'acknowledgment_note')),
+]
+
+_HIGHLIGHT_START, _HIGHLIGHT_END = '\x02', '\x03'
+
+
+def search_index_ddl():
+    """CREATE statements for the FTS tables and their sync triggers."""
+    statements = []
+    for fts, table, columns in SEARCH_TABLES:
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{c}' for c in columns)
+        old = ', '.join(f'old.{c}' for c in columns)
+        statements += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+            f"content_rowid='id', tokenize=\"{TOKENIZE}\")",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        ]
+    return statements
+
+
+def rebuild_search_index():
+    """Creates the FTS tables and triggers if missing and reindexes every row. Does not commit."""
+    for statement in search_index_ddl():
+        db.session.execute(text(statement))
+    for fts, _, _ in SEARCH_TABLES:
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+class SearchUnavailable(Exception):
+    """Raised when the FTS tables are missing (migration not applied) or FTS5 is not compiled in."""
+
+
+def fts_query(terms):
+    """FTS5 MATCH expression for free text: every word must match, each as a prefix."""
+    words = [word.replace('"', '""') for word in terms.split()]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _highlight(snippet):
+    # The snippet is user data: escape it, then turn the match markers into <mark>
+    return Markup(str(escape(snippet)).replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>'))
+
+
+def search(terms, limit=50):
+    """
+    Returns (transactions, invoices) matching terms, best match first (bm25),
+    each row with a highlighted snippet. Raises SearchUnavailable if the
+    search index has not been created.
+    """
+    match = fts_query(terms)
+    if not match:
+        return [], []
+    marks = f"'{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', 12"
+    try:
+        transactions = db.session.execute(text(
+            "SELECT t.id, t.transaction_date, t.transaction_type, t.quantity, t.stock_category_id, t.office_id, "
+            "c.name AS category_name, o.name AS office_name, "
+            f"snippet(stock_transaction_fts, -1, {marks}) AS snippet "
+            "FROM stock_transaction_fts "
+            "JOIN stock_transaction t ON t.id = stock_transaction_fts.rowid "
+            "JOIN stock_category c ON c.id = t.stock_category_id "
+            "LEFT JOIN office o ON o.id = t.office_id "
+            "WHERE stock_transaction_fts MATCH :match "
+            # References and serials count more than notes
+            "ORDER BY bm25(stock_transaction_fts, 5.0, 1.0, 5.0) LIMIT :limit"
+        ).columns(transaction_date=DateTime), {'match': match, 'limit': limit}).all()
+        invoices = db.session.execute(text(
+            "SELECT i.id, i.invoice_number, i.financial_year, i.date, i.quantity, i.acknowledgment_status, "
+            "(SELECT group_concat(c.name, ', ') FROM invoice_line l JOIN stock_category c ON c.id = l.stock_category_id "
+            "WHERE l.invoice_id = i.id) AS category_name, o.name AS office_name, "
+            f"snippet(invoice_fts, -1, {marks}) AS snippet "
+            "FROM invoice_fts "
+            "JOIN invoice i ON i.id = invoice_fts.rowid "
+            "JOIN office o ON o.id = i.office_id "
+            "WHERE invoice_fts MATCH :match "
+            # Invoice numbers count most, then serials, then notes
+            "ORDER BY bm25(invoice_fts, 10.0, 5.0, 1.0) LIMIT :limit"
+        ).columns(date=DateTime), {'match': match, 'limit': limit}).all()
+    except OperationalError as e:
+        db.session.rollback()
+        raise SearchUnavailable(str(e.orig)) from e
+    return ([dict(row._mapping, snippet=_highlight(row.snippet)) for row in transactions],
+            [dict(row._mapping, snippet=_highlight(row.snippet)) for row in invoices])
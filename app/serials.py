@@ -0,0 +1,64 @@
+"""Serial numbers, one row per serial in the serial_number table.
+
+The forms take serials as free text (comma or newline separated, as stored in
+serial_numbers). Each receipt and supply also writes the parsed serials to
+serial_number, indexed by serial (case-insensitively), so "where is serial X"
+is a single indexed lookup instead of a LIKE scan over the free text.
+"""
+import re
+from sqlalchemy import select, func, insert
+from .models import db, SerialNumber, StockTransaction, StockCategory, Office, Invoice
+
+SERIAL_SEPARATORS = re.compile(r'[,;\r\n]+')
+
+
+def parse_serial_numbers(text):
+    """Splits free-text serials on commas, semicolons and newlines; drops blanks and repeats, keeping order."""
+    if not text:
+        return []
+    seen = set()
+    serials = []
+    for part in SERIAL_SEPARATORS.split(text):
+        serial = part.strip()
+        if serial and serial.upper() not in seen:
+            seen.add(serial.upper())
+            serials.append(serial)
+    return serials
+
+
+def record_serial_numbers(transaction_id, serial_numbers, invoice_id=None):
+    """Stores each serial in serial_numbers (free text) against the transaction. Does not commit."""
+    serials = parse_serial_numbers(serial_numbers)
+    if serials:
+        db.session.execute(insert(SerialNumber), [
+            {'serial': serial, 'stock_transaction_id': transaction_id, 'invoice_id': invoice_id}
+            for serial in serials
+        ])
+    return serials
+
+
+def serial_history(serial):
+    """Every movement of a serial, oldest first, with category, office and invoice, in one query."""
+    return db.session.execute(
+        select(
+            SerialNumber.serial,
+            StockTransaction.transaction_date,
+            StockTransaction.transaction_type,
+            StockCategory.name.label('category_name'),
+            func.coalesce(Office.name, 'Head Office').label('office_name'),
+            Invoice.id.label('invoice_id'),
+            Invoice.invoice_number,
+            Invoice.acknowledgment_status,
+            StockTransaction.reference_invoice
+        ).join(
+            StockTransaction, SerialNumber.stock_transaction_id == StockTransaction.id
+        ).join(
+            StockCategory, StockTransaction.stock_category_id == StockCategory.id
+        ).outerjoin(
+            Office, StockTransaction.office_id == Office.id
+        ).outerjoin(
+            Invoice, SerialNumber.invoice_id == Invoice.id
+        ).where(
+            SerialNumber.serial == serial.strip()
+        ).order_by(StockTransaction.transaction_date, StockTransaction.id)
+    ).all()
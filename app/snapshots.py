@@ -0,0 +1,94 @@
+"""Daily closing balance snapshots of head office stock.
+
+stock_balance_snapshot holds, for each category and each day on which it
+moved, the balance at the end of that day. A stock movement adds its quantity
+to the snapshot of its own day (creating it from the previous day's balance)
+and to every later snapshot, so back-dated receipts and supplies keep all
+later closing balances right. Nothing in this module commits.
+
+The balance on any date is then simply the latest snapshot on or before it,
+found with one index seek per category. If the snapshots are ever out of step
+with the transactions (say, after editing the database by hand), run
+`flask rebuild-stock-snapshots`.
+"""
+from datetime import datetime
+from sqlalchemy import select, update, delete, func, text, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import db, StockBalanceSnapshot, StockCategory
+
+# Cumulative sum of each category's daily net movement, used by
+# rebuild_balance_snapshots(); {where} can limit it to some categories
+REBUILD_SNAPSHOTS_SQL = (
+    "INSERT INTO stock_balance_snapshot (stock_category_id, snapshot_date, closing_balance) "
+    "SELECT stock_category_id, day, SUM(day_total) OVER (PARTITION BY stock_category_id ORDER BY day) "
+    "FROM (SELECT stock_category_id, date(transaction_date) AS day, SUM(quantity) AS day_total "
+    "FROM stock_transaction {where}GROUP BY stock_category_id, date(transaction_date))"
+)
+
+
+def record_balance_change(category_id, transaction_date, quantity):
+    """Applies a movement of quantity (negative for supplies) on transaction_date to the snapshots."""
+    day = transaction_date.date() if isinstance(transaction_date, datetime) else transaction_date
+    table = StockBalanceSnapshot.__table__
+    previous = select(table.c.closing_balance).where(
+        table.c.stock_category_id == category_id, table.c.snapshot_date < day
+    ).order_by(table.c.snapshot_date.desc()).limit(1).scalar_subquery()
+
+    stmt = sqlite_insert(table).values(
+        stock_category_id=category_id,
+        snapshot_date=day,
+        closing_balance=func.coalesce(previous, 0) + quantity
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.stock_category_id, table.c.snapshot_date],
+        set_={'closing_balance': table.c.closing_balance + quantity}
+    )
+    db.session.execute(stmt)
+
+    # A back-dated movement also changes every later closing balance
+    db.session.execute(
+        update(table).where(
+            table.c.stock_category_id == category_id, table.c.snapshot_date > day
+        ).values(closing_balance=table.c.closing_balance + quantity)
+    )
+
+
+def stock_balances_as_of(as_of):
+    """
+    Returns {category id: head office balance at the end of as_of} for every
+    category that had moved by then: its latest snapshot on or before as_of.
+    """
+    snapshots = StockBalanceSnapshot.__table__
+    # Correlated ORDER BY ... LIMIT 1: a seek on the (category, date) primary key per category
+    latest = select(snapshots.c.closing_balance).where(
+        snapshots.c.stock_category_id == StockCategory.id,
+        snapshots.c.snapshot_date <= as_of
+    ).order_by(snapshots.c.snapshot_date.desc()).limit(1).correlate(StockCategory).scalar_subquery()
+
+    rows = db.session.execute(select(StockCategory.id, latest.label('balance'))).all()
+    return {category_id: balance for category_id, balance in rows if balance is not None}
+
+
+def rebuild_balance_snapshots(category_ids=None):
+    """
+    Recomputes the snapshots from the transaction history: all of them, or
+    only those of category_ids (as after a bulk import). Returns the number
+    of snapshots rebuilt.
+    """
+    if category_ids is None:
+        db.session.execute(delete(StockBalanceSnapshot))
+        db.session.execute(text(REBUILD_SNAPSHOTS_SQL.format(where='')))
+        return db.session.execute(select(func.count()).select_from(StockBalanceSnapshot)).scalar_one()
+
+    category_ids = list(category_ids)
+    db.session.execute(delete(StockBalanceSnapshot).where(StockBalanceSnapshot.stock_category_id.in_(category_ids)))
+    db.session.execute(
+        text(REBUILD_SNAPSHOTS_SQL.format(where='WHERE stock_category_id IN :category_ids ')).bindparams(
+            bindparam('category_ids', expanding=True)
+        ),
+        {'category_ids': category_ids}
+    )
+    return db.session.execute(
+        select(func.count()).select_from(StockBalanceSnapshot).where(
+            StockBalanceSnapshot.stock_category_id.in_(category_ids))
+    ).scalar_one()
@@ -0,0 +1,175 @@
+"""Stock mutations shared by the receive and supply paths.
+
+Head office stock levels are changed with single guarded UPDATE statements
+instead of loading a StockCategory, checking it in Python and writing it back,
+so concurrent gunicorn workers can neither lose an update nor drive stock
+negative. Nothing in this module commits; callers own the transaction.
+"""
+from datetime import datetime
+from sqlalchemy import select, update
+from .models import db, StockCategory, StockTransaction, Invoice, InvoiceLine
+from .utils import get_financial_year, generate_next_invoice_number
+from .counters import adjust_counter, PENDING_ACKNOWLEDGMENTS
+from .snapshots import record_balance_change
+from .holdings import record_office_receipt
+from .serials import record_serial_numbers
+
+
+class InsufficientStockError(Exception):
+    """Raised when a supply would take a category's stock below zero."""
+
+    def __init__(self, category_id, requested, available):
+        self.category_id = category_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f"Insufficient stock for category {category_id}: requested {requested}, available {available}")
+
+
+def increase_stock(category_id, quantity):
+    """Adds quantity to the category's head office stock and returns the new level."""
+    stmt = update(StockCategory).where(
+        StockCategory.id == category_id
+    ).values(
+        current_stock=StockCategory.current_stock + quantity
+    ).returning(StockCategory.current_stock)
+    new_level = db.session.execute(stmt).scalar_one_or_none()
+    if new_level is None:
+        raise LookupError(f"Stock category {category_id} not found")
+    return new_level
+
+
+def decrease_stock(category_id, quantity):
+    """
+    Takes quantity from the category's head office stock and returns the new level.
+
+    The UPDATE only matches while current_stock >= quantity, so whether a row
+    came back decides success; no separate read is needed on the happy path.
+    """
+    stmt = update(StockCategory).where(
+        StockCategory.id == category_id,
+        StockCategory.current_stock >= quantity
+    ).values(
+        current_stock=StockCategory.current_stock - quantity
+    ).returning(StockCategory.current_stock)
+    new_level = db.session.execute(stmt).scalar_one_or_none()
+    if new_level is None:
+        available = db.session.execute(
+            select(StockCategory.current_stock).where(StockCategory.id == category_id)
+        ).scalar_one_or_none()
+        if available is None:
+            raise LookupError(f"Stock category {category_id} not found")
+        raise InsufficientStockError(category_id, quantity, available)
+    return new_level
+
+
+def record_receipt(category_id, quantity, transaction_date, reference_invoice=None, serial_numbers=None, notes=None):
+    """Increases stock and records the IN transaction. Returns the StockTransaction."""
+    increase_stock(category_id, quantity)
+    record_balance_change(category_id, transaction_date, quantity)
+    transaction = StockTransaction(
+        stock_category_id=category_id,
+        quantity=quantity,
+        transaction_type='IN',
+        transaction_date=transaction_date,
+        reference_invoice=reference_invoice,
+        serial_numbers=serial_numbers,
+        notes=notes
+    )
+    db.session.add(transaction)
+    db.session.flush()
+    record_serial_numbers(transaction.id, serial_numbers)
+    return transaction
+
+
+def _new_invoice(office_id, lines, transaction_date, fy, created_at):
+    """
+    Unsaved Invoice with one InvoiceLine per (category_id, quantity, serial_numbers),
+    numbered in its first line's category series.
+    """
+    first_category_id = lines[0][0]
+    serials = [serial_numbers for _, _, serial_numbers in lines if serial_numbers]
+    return Invoice(
+        # Allocate the invoice number in the same transaction as the invoice itself
+        invoice_number=generate_next_invoice_number(office_id, first_category_id, fy),
+        financial_year=fy,
+        date=transaction_date,
+        created_at=created_at,
+        office_id=office_id,
+        stock_category_id=first_category_id,
+        quantity=sum(quantity for _, quantity, _ in lines),
+        serial_numbers='\n'.join(serials) or None,
+        acknowledgment_status='PENDING',
+        lines=[InvoiceLine(stock_category_id=category_id, quantity=quantity, serial_numbers=serial_numbers)
+               for category_id, quantity, serial_numbers in lines]
+    )
+
+
+def _record_invoice_transactions(invoices, transaction_date):
+    """Records the OUT transaction and serials of every line of the (flushed) invoices."""
+    pairs = [(invoice, line) for invoice in invoices for line in invoice.lines]
+    transactions = [StockTransaction(
+        stock_category_id=line.stock_category_id,
+        office_id=invoice.office_id,
+        quantity=-line.quantity,
+        transaction_type='OUT',
+        transaction_date=transaction_date,
+        invoice_id=invoice.id,
+        serial_numbers=line.serial_numbers
+    ) for invoice, line in pairs]
+    db.session.add_all(transactions)
+    adjust_counter(PENDING_ACKNOWLEDGMENTS, len(invoices))
+    db.session.flush()
+    for transaction, (invoice, line) in zip(transactions, pairs):
+        record_serial_numbers(transaction.id, line.serial_numbers, invoice_id=invoice.id)
+
+
+def record_dispatch(office_id, lines, transaction_date):
+    """
+    Supplies several categories to one office on a single invoice; lines is
+    a list of (category_id, quantity, serial_numbers) with distinct categories.
+    Each line decreases its category's stock and gets its own OUT transaction.
+
+    Raises InsufficientStockError if a category does not hold enough stock;
+    nothing but earlier lines' stock has been written by then, and the caller
+    rolls back. Returns the new Invoice.
+    """
+    for category_id, quantity, _ in lines:
+        decrease_stock(category_id, quantity)
+    for category_id, quantity, _ in lines:
+        record_balance_change(category_id, transaction_date, -quantity)
+
+    fy = get_financial_year(transaction_date)
+    invoice = _new_invoice(office_id, lines, transaction_date, fy, datetime.utcnow())
+    for category_id, quantity, _ in lines:
+        record_office_receipt(office_id, category_id, fy, quantity, transaction_date)
+    db.session.add(invoice)
+    db.session.flush()
+    _record_invoice_transactions([invoice], transaction_date)
+    return invoice
+
+
+def record_distribution(category_id, lines, transaction_date):
+    """
+    Supplies one category to several offices at once; lines is a list of
+    (office_id, quantity, serial_numbers). Stock is checked and decreased
+    once for the total, then each line gets its own invoice and OUT
+    transaction.
+
+    Raises InsufficientStockError (before anything else is written) if the
+    head office does not hold the total. Returns the new Invoices in line order.
+    """
+    total = sum(quantity for _, quantity, _ in lines)
+    decrease_stock(category_id, total)
+    record_balance_change(category_id, transaction_date, -total)
+
+    fy = get_financial_year(transaction_date)
+    created_at = datetime.utcnow()
+    invoices = []
+    for office_id, quantity, serial_numbers in lines:
+        invoices.append(_new_invoice(office_id, [(category_id, quantity, serial_numbers)],
+                                     transaction_date, fy, created_at))
+        record_office_receipt(office_id, category_id, fy, quantity, transaction_date)
+    db.session.add_all(invoices)
+    db.session.flush()
+    _record_invoice_transactions(invoices, transaction_date)
+    return invoices
@@ -1,8 +1,16 @@
+import hashlib
+import json
+import time
 from datetime import datetime
-from .models import Invoice, db
+from .models import InvoiceSequence, db
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from io import BytesIO
 from xhtml2pdf import pisa
 from flask import render_template_string, make_response, current_app, render_template
+from jinja2 import TemplateNotFound
+from .pdf_cache import get_pdf_cache
+from .metrics import observe_pdf_render
+from .pdf_reportlab import render_invoice_pdf as render_reportlab_invoice
 
 def get_financial_year(date=None):
     """Determines the financial year (April 1 - March 31) for a given date."""
@@ -16,53 +24,75 @@ def get_financial_year(date=None):
 
 def generate_next_invoice_number(office_id, stock_category_id, financial_year):
     """
-    Generates the next sequential invoice number for a given office,
+    Allocates the next sequential invoice number for a given office,
     stock category, and financial year. Starts from 1 each financial year.
+
+    The counter row is created or incremented with a single upsert inside the
+    caller's transaction, so the number is only consumed if the invoice is
+    committed and two workers can never be handed the same number.
+    """
+    return allocate_invoice_numbers(office_id, stock_category_id, financial_year, 1)[0]
+
+def allocate_invoice_numbers(office_id, stock_category_id, financial_year, count):
     """
-    # Find the numerically highest invoice number for this combination in the current FY
-    last_invoice = Invoice.query.filter_by(
+    Allocates count consecutive invoice numbers for one office, stock
+    category and financial year with a single upsert (as above), and returns
+    them in order as strings. Used by bulk imports.
+    """
+    sequence = InvoiceSequence.__table__
+    stmt = sqlite_insert(sequence).values(
         office_id=office_id,
         stock_category_id=stock_category_id,
-        financial_year=financial_year
-    ).order_by(db.cast(Invoice.invoice_number, db.Integer).desc()).first()
+        financial_year=financial_year,
+        last_number=count
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[sequence.c.office_id, sequence.c.stock_category_id, sequence.c.financial_year],
+        set_={'last_number': sequence.c.last_number + count}
+    ).returning(sequence.c.last_number)
 
-    if last_invoice:
-        try:
-            next_num = int(last_invoice.invoice_number) + 1
-        except ValueError:
-             # Fallback if somehow the last invoice number wasn't an integer
-             current_app.logger.warning(f"Non-integer invoice number found: {last_invoice.invoice_number} for FY {financial_year}. Restarting count.")
-             next_num = 1 # Or handle error differently
-    else:
-        # No previous invoice for this combo in this FY, start at 1
-        next_num = 1
-
-    return str(next_num) # Return as string
-
-def render_pdf(template_src, context_dict={}):
-    """Renders an HTML template to a PDF file response."""
+    last_num = db.session.execute(stmt).scalar_one()
+    return [str(num) for num in range(last_num - count + 1, last_num + 1)]
+
+class PdfRenderError(Exception):
+    """Raised when xhtml2pdf cannot convert a document."""
+
+def render_pdf_html(template_src, context_dict={}):
+    """Renders the HTML that will be converted to PDF."""
     # Try loading from file first, fallback to string if needed
     try:
-        html = render_template(template_src, **context_dict)
+        return render_template(template_src, **context_dict)
     except Exception:
          # Fallback to the hardcoded template string if file loading fails or not used
-         html = render_template_string(INVOICE_TEMPLATE_HTML, **context_dict)
+         return render_template_string(INVOICE_TEMPLATE_HTML, **context_dict)
 
+def html_to_pdf(html):
+    """
+    Converts an HTML document to PDF bytes with xhtml2pdf.
+
+    Needs no app context, so it can run in a render worker process.
+    Raises PdfRenderError if the conversion fails, including when xhtml2pdf
+    or ReportLab raise on malformed input, so bulk exports can skip the invoice.
+    """
     result = BytesIO()
-    # Ensure encoding is UTF-8 for special characters
-    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding='UTF-8')
-
-    if not pdf.err:
-        response = make_response(result.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        # Get invoice number safely - context_dict contains the actual Invoice object
-        invoice = context_dict.get('invoice')
-        invoice_number = invoice.invoice_number if invoice else 'details'
-        response.headers['Content-Disposition'] = f'inline; filename=invoice_{invoice_number}.pdf'
-        return response
-    else:
-        current_app.logger.error(f"Error generating PDF: {pdf.err}")
-        return "Error generating PDF", 500
+    try:
+        # Ensure encoding is UTF-8 for special characters
+        pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding='UTF-8')
+    except Exception as e:
+        raise PdfRenderError(str(e)) from e
+    if pdf.err:
+        raise PdfRenderError(pdf.err)
+    return result.getvalue()
+
+def pdf_response(data, invoice_number='details'):
+    """Wraps PDF bytes in an inline PDF response."""
+    response = make_response(data)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'inline; filename=invoice_{invoice_number}.pdf'
+    return response
+
+# Invoice template file in app/templates; INVOICE_TEMPLATE_HTML is used when it is missing
+INVOICE_TEMPLATE_FILE = 'invoice_template.html'
 
 # Basic Invoice HTML Template
 INVOICE_TEMPLATE_HTML = """
@@ -107,17 +137,31 @@ INVOICE_TEMPLATE_HTML = """
             </tr>
         </thead>
         <tbody>
+            {% for line in invoice.lines %}
+            <tr>
+                <td>{{ line.stock_category.name }}</td>
+                <td>{{ line.quantity }}</td>
+            </tr>
+            {% endfor %}
+            {% if invoice.lines|length > 1 %}
             <tr>
-                <td>{{ invoice.stock_category.name }}</td>
-                <td>{{ invoice.quantity }}</td>
+                <th>Total</th>
+                <th>{{ invoice.quantity }}</th>
             </tr>
+            {% endif %}
         </tbody>
     </table>
 
     {% if invoice.serial_numbers %}
     <div class="serial-numbers">
         <strong>Serial Numbers:</strong><br>
+        {% if invoice.lines|length > 1 %}
+            {% for line in invoice.lines if line.serial_numbers %}
+            {{ line.stock_category.name }}: {{ line.serial_numbers }}<br>
+            {% endfor %}
+        {% else %}
         {{ invoice.serial_numbers }}
+        {% endif %}
     </div>
     {% endif %}
 
@@ -136,8 +180,98 @@ INVOICE_TEMPLATE_HTML = """
 </html>
 """
 
-def generate_invoice_pdf(invoice):
-    """Generates a PDF response for a given invoice object."""
+def invoice_print_fields(invoice):
+    """
+    Everything an invoice PDF prints, as plain data. Picklable, so the ReportLab
+    renderer can run on it in a render worker process.
+    """
+    return {
+        'invoice_number': invoice.invoice_number,
+        'financial_year': invoice.financial_year,
+        'date': invoice.date,
+        'created_at': invoice.created_at,
+        'office_name': invoice.office.name,
+        'lines': [{'category_name': line.stock_category.name, 'quantity': line.quantity,
+                   'serial_numbers': line.serial_numbers or ''} for line in invoice.lines],
+        'quantity': invoice.quantity,
+        'serial_numbers': invoice.serial_numbers or '',
+    }
+
+def invoice_template_source():
+    """Source of the template render_invoice_html uses: invoice_template.html if present, else INVOICE_TEMPLATE_HTML."""
+    try:
+        return current_app.jinja_env.loader.get_source(current_app.jinja_env, INVOICE_TEMPLATE_FILE)[0]
+    except TemplateNotFound:
+        return INVOICE_TEMPLATE_HTML
+
+def invoice_pdf_fingerprint(invoice):
+    """
+    Hash of everything the invoice PDF prints (and of the renderer and template),
+    used to key the PDF cache so an edited invoice never matches a stale entry.
+    """
+    renderer = current_app.config['PDF_RENDERER']
+    fingerprint = json.dumps({
+        'renderer': renderer,
+        'template': invoice_template_source() if renderer != 'reportlab' else None,
+        'fields': invoice_print_fields(invoice),
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+def invoice_pdf_cache_key(invoice):
+    """Key of the invoice's PDF in the PDF cache (also used as the render job id)."""
+    return get_pdf_cache().key(invoice.id, invoice_pdf_fingerprint(invoice))
+
+def render_invoice_html(invoice):
+    """HTML for the invoice PDF."""
     context = {'invoice': invoice}
     # Use the HTML template file if it exists, otherwise the string above
-    return render_pdf('invoice_template.html', context)
\ No newline at end of file
+    return render_pdf_html(INVOICE_TEMPLATE_FILE, context)
+
+def reportlab_invoice_to_pdf(fields):
+    """Draws the invoice PDF with ReportLab. Raises PdfRenderError if that fails."""
+    try:
+        return render_reportlab_invoice(fields)
+    except Exception as e:
+        raise PdfRenderError(str(e)) from e
+
+def invoice_render_job(invoice):
+    """
+    (function, argument) that produces the invoice PDF with the configured
+    PDF_RENDERER. Both are picklable, so the call can run in a render worker.
+    """
+    if current_app.config['PDF_RENDERER'] == 'reportlab':
+        return reportlab_invoice_to_pdf, invoice_print_fields(invoice)
+    return html_to_pdf, render_invoice_html(invoice)
+
+def generate_invoice_pdf(invoice):
+    """Generates a PDF response for a given invoice object, served from the PDF cache when possible."""
+    cache = get_pdf_cache()
+    key = invoice_pdf_cache_key(invoice) if cache else None
+    data = cache.get(key) if cache else None
+
+    if data is None:
+        started = time.perf_counter()
+        render, argument = invoice_render_job(invoice)
+        try:
+            data = render(argument)
+        except PdfRenderError as e:
+            current_app.logger.error(f"Error generating PDF: {e}")
+            return "Error generating PDF", 500
+        finally:
+            observe_pdf_render(current_app.config['PDF_RENDERER'], time.perf_counter() - started)
+        if cache:
+            cache.put(key, data)
+
+    return pdf_response(data, invoice.invoice_number)
+
+def invalidate_invoice_pdf(invoice_id):
+    """Drops any cached PDF of the invoice; call after editing it."""
+    cache = get_pdf_cache()
+    if cache:
+        cache.invalidate(invoice_id)
+
+def invalidate_invoice_pdfs(invoice_ids):
+    """Drops any cached PDFs of the invoices, in one pass over the cache; call after a bulk edit."""
+    cache = get_pdf_cache()
+    if cache:
+        cache.invalidate_many(invoice_ids)
@@ -0,0 +1,77 @@
+"""Per-invoice render time and peak memory of the two invoice PDF renderers.
+
+Run from the repository root:
+
+    python benchmarks/pdf_renderers.py [iterations]
+
+Renders the same sample invoice (with a long serial number list) with
+xhtml2pdf (INVOICE_TEMPLATE_HTML) and with the ReportLab renderer, outside
+Flask, and prints the mean/min time per invoice and the peak Python memory
+allocated during one render (tracemalloc).
+"""
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from jinja2 import Template  # noqa: E402
+from app.utils import INVOICE_TEMPLATE_HTML, html_to_pdf, invoice_print_fields  # noqa: E402
+from app.pdf_reportlab import render_invoice_pdf  # noqa: E402
+
+
+def sample_invoice():
+    serials = ', '.join(f"SN-{n:06d}" for n in range(1, 41))
+    laptop = SimpleNamespace(name='Laptop')
+    return SimpleNamespace(
+        invoice_number='128',
+        financial_year='FY2025-2026',
+        date=datetime(2025, 11, 3),
+        created_at=datetime(2025, 11, 3, 14, 22, 9),
+        office=SimpleNamespace(name='Sub-Office North'),
+        stock_category=laptop,
+        lines=[SimpleNamespace(stock_category=laptop, quantity=40, serial_numbers=serials)],
+        quantity=40,
+        serial_numbers=serials,
+    )
+
+
+def engines(invoice):
+    html = Template(INVOICE_TEMPLATE_HTML).render(invoice=invoice)
+    fields = invoice_print_fields(invoice)
+    return {
+        'xhtml2pdf': lambda: html_to_pdf(html),
+        'reportlab': lambda: render_invoice_pdf(fields),
+    }
+
+
+def measure(render, iterations):
+    render()  # Warm up imports, fonts and caches
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        data = render()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak, len(data)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{'engine':<10} {'mean ms':>9} {'min ms':>9} {'peak KiB':>9} {'size KiB':>9}")
+    for name, render in engines(sample_invoice()).items():
+        timings, peak, size = measure(render, iterations)
+        print(f"{name:<10} {statistics.mean(timings) * 1000:9.1f} {min(timings) * 1000:9.1f} "
+              f"{peak / 1024:9.0f} {size / 1024:9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Add serial_number table and widen serial_numbers columns
+
+Revision ID: 2f7c4b9e6a13
+Revises: e3a9c2d7b814
+Create Date: 2026-10-18 15:47:02.903114
+
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f7c4b9e6a13'
+down_revision = 'e3a9c2d7b814'
+branch_labels = None
+depends_on = None
+
+# Same rules as app.serials.parse_serial_numbers at the time of this migration
+SERIAL_SEPARATORS = re.compile(r'[,;\r\n]+')
+
+
+def _parse(text):
+    seen = set()
+    serials = []
+    for part in SERIAL_SEPARATORS.split(text or ''):
+        serial = part.strip()
+        if serial and serial.upper() not in seen:
+            seen.add(serial.upper())
+            serials.append(serial)
+    return serials
+
+
+def upgrade():
+    op.create_table('serial_number',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('serial', sa.String(length=100, collation='NOCASE'), nullable=False),
+    sa.Column('stock_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('invoice_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['invoice_id'], ['invoice.id'], ),
+    sa.ForeignKeyConstraint(['stock_transaction_id'], ['stock_transaction.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('serial_number', schema=None) as batch_op:
+        batch_op.create_index('ix_serial_number_serial', ['serial'], unique=False)
+        batch_op.create_index('ix_serial_number_stock_transaction_id', ['stock_transaction_id'], unique=False)
+
+    # Long batches no longer fit String(500)
+    with op.batch_alter_table('stock_transaction', schema=None) as batch_op:
+        batch_op.alter_column('serial_numbers', existing_type=sa.String(length=500), type_=sa.Text(), existing_nullable=True)
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.alter_column('serial_numbers', existing_type=sa.String(length=500), type_=sa.Text(), existing_nullable=True)
+
+    # Backfill from the free text of existing transactions (a supply's invoice has the same serials)
+    bind = op.get_bind()
+    serial_number = sa.table('serial_number',
+                             sa.column('serial', sa.String), sa.column('stock_transaction_id', sa.Integer),
+                             sa.column('invoice_id', sa.Integer))
+    rows = bind.execute(sa.text(
+        "SELECT id, invoice_id, serial_numbers FROM stock_transaction "
+        "WHERE serial_numbers IS NOT NULL AND serial_numbers != ''"
+    ))
+    batch = []
+    for transaction_id, invoice_id, text in rows:
+        batch.extend({'serial': serial, 'stock_transaction_id': transaction_id, 'invoice_id': invoice_id}
+                     for serial in _parse(text))
+        if len(batch) >= 5000:
+            op.bulk_insert(serial_number, batch)
+            batch = []
+    if batch:
+        op.bulk_insert(serial_number, batch)
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.alter_column('serial_numbers', existing_type=sa.Text(), type_=sa.String(length=500), existing_nullable=True)
+    with op.batch_alter_table('stock_transaction', schema=None) as batch_op:
+        batch_op.alter_column('serial_numbers', existing_type=sa.Text(), type_=sa.String(length=500), existing_nullable=True)
+    with op.batch_alter_table('serial_number', schema=None) as batch_op:
+        batch_op.drop_index('ix_serial_number_stock_transaction_id')
+        batch_op.drop_index('ix_serial_number_serial')
+    op.drop_table('serial_number')
@@ -0,0 +1,38 @@
+"""Add stock_balance_snapshot table
+
+Revision ID: 5b8d0e7f2c61
+Revises: a41f6c3e9b20
+Create Date: 2026-10-18 14:12:40.186355
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d0e7f2c61'
+down_revision = 'a41f6c3e9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_balance_snapshot',
+    sa.Column('stock_category_id', sa.Integer(), nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('closing_balance', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['stock_category_id'], ['stock_category.id'], ),
+    sa.PrimaryKeyConstraint('stock_category_id', 'snapshot_date')
+    )
+
+    # Backfill: running total of each category's daily net movement
+    op.execute(
+        "INSERT INTO stock_balance_snapshot (stock_category_id, snapshot_date, closing_balance) "
+        "SELECT stock_category_id, day, SUM(day_total) OVER (PARTITION BY stock_category_id ORDER BY day) "
+        "FROM (SELECT stock_category_id, date(transaction_date) AS day, SUM(quantity) AS day_total "
+        "FROM stock_transaction GROUP BY stock_category_id, date(transaction_date))"
+    )
+
+
+def downgrade():
+    op.drop_table('stock_balance_snapshot')
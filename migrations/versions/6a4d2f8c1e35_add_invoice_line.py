@@ -0,0 +1,43 @@
+"""Add invoice_line table for multi-line invoices
+
+Revision ID: 6a4d2f8c1e35
+Revises: 8c1e5f3a7d92
+Create Date: 2026-10-18 17:05:31.204876
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a4d2f8c1e35'
+down_revision = '8c1e5f3a7d92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('invoice_line',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('invoice_id', sa.Integer(), nullable=False),
+    sa.Column('stock_category_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('serial_numbers', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['invoice_id'], ['invoice.id'], ),
+    sa.ForeignKeyConstraint(['stock_category_id'], ['stock_category.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('invoice_id', 'stock_category_id', name='uq_invoice_line_invoice_category')
+    )
+    op.create_index('ix_invoice_line_category', 'invoice_line', ['stock_category_id'], unique=False)
+
+    # Every existing invoice becomes a header with a single line
+    op.execute(
+        "INSERT INTO invoice_line (invoice_id, stock_category_id, quantity, serial_numbers) "
+        "SELECT id, stock_category_id, quantity, serial_numbers FROM invoice ORDER BY id"
+    )
+
+
+def downgrade():
+    # Multi-line invoices keep only their header: first category and total quantity
+    op.drop_index('ix_invoice_line_category', table_name='invoice_line')
+    op.drop_table('invoice_line')
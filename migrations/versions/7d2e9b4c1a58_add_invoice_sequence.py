@@ -0,0 +1,39 @@
+"""Add invoice_sequence counter table
+
+Revision ID: 7d2e9b4c1a58
+Revises: 3c6f1a2d8e47
+Create Date: 2026-10-18 11:04:52.778310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e9b4c1a58'
+down_revision = '3c6f1a2d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('invoice_sequence',
+    sa.Column('office_id', sa.Integer(), nullable=False),
+    sa.Column('stock_category_id', sa.Integer(), nullable=False),
+    sa.Column('financial_year', sa.String(length=10), nullable=False),
+    sa.Column('last_number', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['office_id'], ['office.id'], ),
+    sa.ForeignKeyConstraint(['stock_category_id'], ['stock_category.id'], ),
+    sa.PrimaryKeyConstraint('office_id', 'stock_category_id', 'financial_year')
+    )
+
+    # Backfill from the invoices issued so far (non-numeric numbers cast to 0)
+    op.execute(
+        "INSERT INTO invoice_sequence (office_id, stock_category_id, financial_year, last_number) "
+        "SELECT office_id, stock_category_id, financial_year, MAX(CAST(invoice_number AS INTEGER)) "
+        "FROM invoice GROUP BY office_id, stock_category_id, financial_year"
+    )
+
+
+def downgrade():
+    op.drop_table('invoice_sequence')
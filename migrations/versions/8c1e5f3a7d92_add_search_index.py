@@ -0,0 +1,55 @@
+"""Add FTS5 search index over transactions and invoices
+
+Revision ID: 8c1e5f3a7d92
+Revises: 2f7c4b9e6a13
+Create Date: 2026-10-18 16:21:44.518230
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5f3a7d92'
+down_revision = '2f7c4b9e6a13'
+branch_labels = None
+depends_on = None
+
+# Same tables and tokenizer as app.search at the time of this migration
+TOKENIZE = "unicode61 tokenchars '-_/'"
+SEARCH_TABLES = [
+    ('stock_transaction_fts', 'stock_transaction', ('reference_invoice', 'notes', 'serial_numbers')),
+    ('invoice_fts', 'invoice', ('invoice_number', 'serial_numbers', 'acknowledgment_note')),
+]
+
+
+def upgrade():
+    for fts, table, columns in SEARCH_TABLES:
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{c}' for c in columns)
+        old = ', '.join(f'old.{c}' for c in columns)
+        op.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', "
+            f"content_rowid='id', tokenize=\"{TOKENIZE}\")"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        # Index the rows that already exist
+        op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    for fts, _, _ in reversed(SEARCH_TABLES):
+        for suffix in ('au', 'ad', 'ai'):
+            op.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+        op.execute(f"DROP TABLE IF EXISTS {fts}")
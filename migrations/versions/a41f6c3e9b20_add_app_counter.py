@@ -0,0 +1,34 @@
+"""Add app_counter table for stored aggregates
+
+Revision ID: a41f6c3e9b20
+Revises: 7d2e9b4c1a58
+Create Date: 2026-10-18 12:31:07.415902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6c3e9b20'
+down_revision = '7d2e9b4c1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('app_counter',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Seed the navbar badge counter from the invoices pending so far
+    op.execute(
+        "INSERT INTO app_counter (name, value) "
+        "SELECT 'pending_acknowledgments', COUNT(*) FROM invoice WHERE acknowledgment_status = 'PENDING'"
+    )
+
+
+def downgrade():
+    op.drop_table('app_counter')
@@ -0,0 +1,40 @@
+"""Add office_stock holdings table
+
+Revision ID: e3a9c2d7b814
+Revises: 5b8d0e7f2c61
+Create Date: 2026-10-18 15:03:18.552017
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c2d7b814'
+down_revision = '5b8d0e7f2c61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('office_stock',
+    sa.Column('office_id', sa.Integer(), nullable=False),
+    sa.Column('stock_category_id', sa.Integer(), nullable=False),
+    sa.Column('financial_year', sa.String(length=10), nullable=False),
+    sa.Column('quantity_received', sa.Integer(), nullable=False),
+    sa.Column('last_supply_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['office_id'], ['office.id'], ),
+    sa.ForeignKeyConstraint(['stock_category_id'], ['stock_category.id'], ),
+    sa.PrimaryKeyConstraint('office_id', 'stock_category_id', 'financial_year')
+    )
+
+    # Backfill from the invoices issued so far
+    op.execute(
+        "INSERT INTO office_stock (office_id, stock_category_id, financial_year, quantity_received, last_supply_date) "
+        "SELECT office_id, stock_category_id, financial_year, SUM(quantity), MAX(date) "
+        "FROM invoice GROUP BY office_id, stock_category_id, financial_year"
+    )
+
+
+def downgrade():
+    op.drop_table('office_stock')
@@ -0,0 +1,62 @@
+"""The listing pages run the same number of SQL statements however many rows they show."""
+from datetime import datetime
+import pytest
+from app import create_app
+from app.models import db, StockCategory, Office
+from app.stock_service import record_receipt, record_dispatch
+
+DAY = datetime(2026, 5, 2)
+
+PAGES = [
+    '/invoices?from_date=2026-05-01&to_date=2026-05-31',
+    '/reports/transactions?from_date=2026-05-01&to_date=2026-05-31',
+    '/acknowledgments?status=PENDING',
+    '/daily-supply-report?date=2026-05-02',
+]
+
+
+def make_app(tmp_path, rows):
+    """App on a fresh database holding rows two-line invoices, each for its own office and categories."""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / f'rows{rows}.db'}",
+        'PDF_CACHE_DIR': str(tmp_path / 'pdf_cache'),
+        'METRICS_DIR': str(tmp_path / 'metrics'),
+        'SQL_QUERY_BUDGET_MODE': 'raise',
+    })
+    with app.app_context():
+        db.create_all()
+        for n in range(rows):
+            categories = [StockCategory(name=f'Category {n}-{i}', current_stock=0) for i in range(2)]
+            office = Office(name=f'Office {n}')
+            db.session.add_all(categories + [office])
+            db.session.flush()
+            for category in categories:
+                record_receipt(category.id, 10, DAY, serial_numbers=f'SN-{n}')
+            record_dispatch(office.id, [(category.id, 1, f'SN-{n}') for category in categories], DAY)
+        db.session.commit()
+    return app
+
+
+def page_query_counts(app):
+    client = app.test_client()
+    counts = {}
+    for url in PAGES:
+        client.get(url)  # Fills the per-worker office and category cache
+        response = client.get(url)
+        assert response.status_code == 200, url
+        counts[url] = int(response.headers['X-SQL-Query-Count'])
+    return counts
+
+
+def test_page_query_count_does_not_grow_with_rows(tmp_path):
+    one = page_query_counts(make_app(tmp_path, 1))
+    many = page_query_counts(make_app(tmp_path, 50))
+    assert many == one
+
+
+@pytest.mark.parametrize('url', PAGES)
+def test_pages_stay_within_budget(tmp_path, url):
+    # SQL_QUERY_BUDGET_MODE = 'raise' turns an overrun into QueryBudgetExceeded
+    response = make_app(tmp_path, 50).test_client().get(url)
+    assert response.status_code == 200